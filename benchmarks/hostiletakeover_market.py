@@ -0,0 +1,114 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+
+"""
+Throughput benchmark for HostileTakeover's share market.
+Random limit orders around a drifting price are sent through ShareMarket.place for one company, once with open
+orders saved to SQLite as the plugin does and once with saving skipped, so the matching engine is measured on its own.
+
+Run it from the Telegram-Response-Bot folder so the bot's plugin module can be imported:
+    python path/to/benchmarks/hostiletakeover_market.py --orders 20000
+"""
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from plugins.hostiletakeover import Company, CompanyStore, ShareMarket
+
+
+# In memory stand in for HonorBank, the real one rereads honor.json on every call which would dominate the timings
+class MemoryBank:
+    def __init__(self):
+        self.accounts = {}
+        self.lock = threading.Lock()
+
+    def account_exists(self, name):
+        return name in self.accounts
+
+    def charge(self, name, amount):
+        with self.lock:
+            if self.accounts[name] >= amount:
+                self.accounts[name] -= amount
+                return True
+            return False
+
+    def pay(self, name, amount):
+        with self.lock:
+            self.accounts[name] += amount
+            return True
+
+
+# Stand in for CompanyStore that keeps nothing, used to time matching without SQLite
+class NullStore:
+    def load_orders(self):
+        return []
+
+    def save_orders(self, orders, company=None):
+        pass
+
+
+def run(store, orders, traders, seed):
+    """
+    :param store: CompanyStore or NullStore the market saves to
+    :param orders: the amount of orders to place
+    :param traders: the amount of users trading, each starts with an equal part of the shares
+    :param seed: seed for the random orders, so every run places the same ones
+    :return: (seconds spent placing orders, orders placed, fills)
+    """
+
+    random.seed(seed)
+    bank = MemoryBank()
+    users = ["user{}".format(x) for x in range(traders)]
+    for user in users:
+        bank.accounts[user] = 10 ** 12
+
+    company = Company("benchmark", users[0])
+    company.tier = 4
+    company.shares = {user: 100 // traders for user in users}
+    company.shares[users[0]] += 100 - sum(company.shares.values())
+
+    market = ShareMarket(store, bank)
+    price = 1000
+    placed = 0
+    fills = 0
+
+    start = perf_counter()
+    for x in range(orders):
+        price = max(10, price + random.randint(-5, 5))
+        side = random.choice(("bid", "ask"))
+        result = market.place(company, random.choice(users), side, price + random.randint(-20, 20),
+                              random.randint(1, 5))
+        if result is not None:
+            placed += 1
+            fills += len(result[1])
+    return perf_counter() - start, placed, fills
+
+
+def report(name, elapsed, placed, fills):
+    print("Market benchmark: {:<16} {} orders placed, {} fills in {:.2f}s ({:.0f} orders/s, {:.0f} fills/s)".format(
+        name, placed, fills, elapsed, placed / elapsed, fills / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure ShareMarket throughput in orders and fills per second")
+    parser.add_argument("--orders", type=int, default=20000, help="orders sent to the market")
+    parser.add_argument("--traders", type=int, default=20, help="users placing orders")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random orders")
+    args = parser.parse_args()
+
+    report("matching only", *run(NullStore(), args.orders, args.traders, args.seed))
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = CompanyStore(data_dir + "/data/companies.db")
+        report("with SQLite", *run(store, args.orders, args.traders, args.seed))
+        store.connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+
+"""
+Checks MediaCache against a local stand in for the bot's send_photo, so no Telegram connection is needed.
+Asserts that an image is uploaded once, that repeat sends and a freshly loaded cache reuse its file_id,
+and that it is uploaded again once the file changes or Telegram rejects the cached file_id.
+    python path/to/benchmarks/mediacache_check.py
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from libs.mediacache import MediaCache
+
+
+# Stand in for the bot, answers like Telegram: uploads get a new file_id and known file_ids are sent as they are
+class FakeBot:
+    def __init__(self):
+        self.uploads = 0
+        self.file_id_sends = 0
+        # Set of file_ids this fake Telegram still accepts
+        self.known = set()
+
+    def send_photo(self, chat_id, photo, caption=""):
+        if isinstance(photo, str):
+            if photo not in self.known:
+                raise ValueError("wrong file identifier")
+            self.file_id_sends += 1
+            file_id = photo
+        else:
+            photo.read()
+            self.uploads += 1
+            file_id = "file{}".format(self.uploads)
+            self.known.add(file_id)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=file_id + "_small"), SimpleNamespace(file_id=file_id)])
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+        f.close()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as data_dir:
+        cache_file = data_dir + "/media_cache.json"
+        image = data_dir + "/tame.png"
+        copy = data_dir + "/copy.png"
+        write(image, b"first image")
+        write(copy, b"first image")
+
+        bot = FakeBot()
+        cache = MediaCache(cache_file)
+
+        cache.send_photo(bot, 1, image)
+        assert bot.uploads == 1, "the first send should upload the image"
+
+        for x in range(3):
+            message = cache.send_photo(bot, 1, image)
+            assert message.photo[-1].file_id == "file1"
+        assert bot.uploads == 1 and bot.file_id_sends == 3, "repeat sends should reuse the file_id"
+
+        cache.send_photo(bot, 1, copy)
+        assert bot.uploads == 1, "an identical image at another path should reuse the file_id"
+
+        reloaded = MediaCache(cache_file)
+        assert reloaded.get_file_id(image) == "file1"
+        reloaded.send_photo(bot, 1, image)
+        assert bot.uploads == 1, "a new cache loaded from disk should reuse the file_id"
+
+        write(image, b"second, larger image")
+        stat = os.stat(image)
+        os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        reloaded.send_photo(bot, 1, image)
+        assert bot.uploads == 2, "a changed image should be uploaded again"
+        reloaded.send_photo(bot, 1, image)
+        assert bot.uploads == 2, "the changed image's new file_id should be reused"
+
+        bot.known.clear()
+        reloaded.send_photo(bot, 1, image)
+        assert bot.uploads == 3, "a rejected file_id should fall back to uploading"
+
+    print("MediaCache check: passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import traceback
+from time import perf_counter, time
+from types import SimpleNamespace
+
+
+"""
+Stress test for PocketPal's PalStore.
+Several threads fire random adopt, feed, play, check and sell commands at the plugin while another thread
+keeps running the update loop's work (sweeping idle pals through their missed ticks and saving snapshots).
+Afterwards the store's ownership bookkeeping is checked and the saved file is loaded back.
+
+Run it from the Telegram-Response-Bot folder so the bot's plugin module can be imported:
+    python path/to/benchmarks/pocketpal_stress.py --threads 8 --commands 3000
+"""
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from plugins.pocketpal import Food, Game, PocketPal
+
+
+# In memory stand in for HonorBank, the real one rereads honor.json on every call which would hide any contention
+class MemoryBank:
+    def __init__(self):
+        self.accounts = {}
+        self.lock = threading.Lock()
+
+    def account_exists(self, name):
+        return name in self.accounts
+
+    def create_account(self, name):
+        with self.lock:
+            self.accounts.setdefault(name, 10 ** 9)
+
+    def charge(self, name, amount):
+        with self.lock:
+            if self.accounts[name] >= amount:
+                self.accounts[name] -= amount
+                return True
+            return False
+
+    def pay(self, name, amount):
+        with self.lock:
+            self.accounts[name] += amount
+            return True
+
+
+def command(user, args=""):
+    return SimpleNamespace(user=SimpleNamespace(username=user), args=args)
+
+
+def worker(pocket_pal, users, commands, errors):
+    """
+    Runs random commands against the plugin, roughly a quarter each of adopting and feeding,
+    a fifth playing and the rest checking and selling
+    """
+
+    try:
+        for x in range(commands):
+            user = random.choice(users)
+            roll = random.random()
+
+            if roll < 0.25:
+                pocket_pal.com_new(command(user, "pal"))
+            elif roll < 0.5:
+                pocket_pal.com_feed(command(user, random.choice(list(Food)).name))
+            elif roll < 0.7:
+                pocket_pal.com_play(command(user, random.choice(list(Game)).name))
+            elif roll < 0.8:
+                pocket_pal.com_check(command(user))
+            else:
+                pocket_pal.com_sell(command(user))
+    except Exception:
+        errors.append(traceback.format_exc())
+
+
+def ticker(pocket_pal, stop, errors):
+    """
+    Does what PocketPal.update does every few minutes, as fast as it can.
+    Sweeps are run up to ten ticks in the future so pals actually age, starve and die during the test.
+    """
+
+    try:
+        while not stop.is_set():
+            pocket_pal.pals.sweep(now=time() + random.randint(0, 10) * pocket_pal.pals.tick_length)
+            pocket_pal.save()
+    except Exception:
+        errors.append(traceback.format_exc())
+
+
+def check_store(pals):
+    """
+    :param pals: the PalStore once every thread has stopped
+    :return: a list describing every broken invariant
+    """
+
+    problems = []
+    rows = list(pals.owners.values())
+
+    if len(rows) != len(set(rows)):
+        problems.append("several users own the same row")
+    if set(rows) & set(pals.free):
+        problems.append("owned rows are on the free list")
+    if len(rows) + len(pals.free) != pals.capacity:
+        problems.append("{} owned and {} free rows don't add up to a capacity of {}".format(len(rows), len(pals.free),
+                                                                                          pals.capacity))
+    if not all(pals.in_use[row] and pals.names[row] is not None for row in rows):
+        problems.append("an owned row isn't marked in use")
+    if any(pals.in_use[row] or pals.names[row] is not None for row in pals.free):
+        problems.append("a free row still holds a pal")
+    if len(pals.pal_locks) != pals.capacity:
+        problems.append("there are {} row locks for {} rows".format(len(pals.pal_locks), pals.capacity))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test PocketPal with concurrent commands")
+    parser.add_argument("--threads", type=int, default=8, help="threads sending commands")
+    parser.add_argument("--commands", type=int, default=3000, help="commands sent by each thread")
+    parser.add_argument("--users", type=int, default=40, help="users the commands are spread across")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        # The plugin keeps honor.json and media_cache.json relative to where it runs, keep them out of the bot's folder
+        os.chdir(data_dir)
+        for species in ("cat", "dog"):
+            os.makedirs(os.path.join(data_dir, "assets", species))
+
+        pocket_pal = PocketPal(data_dir, None)
+        pocket_pal.account_manager = MemoryBank()
+        users = ["user{}".format(x) for x in range(args.users)]
+
+        errors = []
+        stop = threading.Event()
+        tick_thread = threading.Thread(target=ticker, args=(pocket_pal, stop, errors))
+        threads = [threading.Thread(target=worker, args=(pocket_pal, users, args.commands, errors))
+                   for x in range(args.threads)]
+
+        start = perf_counter()
+        tick_thread.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+        stop.set()
+        tick_thread.join()
+
+        problems = check_store(pocket_pal.pals)
+        pocket_pal.save()
+        reloaded = PocketPal(data_dir, None).pals
+        if len(reloaded) != len(pocket_pal.pals):
+            problems.append("saved {} pals but loaded {}".format(len(pocket_pal.pals), len(reloaded)))
+        problems += ["reloaded store: " + problem for problem in check_store(reloaded)]
+
+        total = args.threads * args.commands
+        print("PocketPal stress: {} commands from {} threads in {:.1f}s ({:.0f}/s), {} pals in {} rows".format(
+            total, args.threads, elapsed, total / elapsed, len(pocket_pal.pals), pocket_pal.pals.capacity))
+
+        for error in errors:
+            print(error)
+        for problem in problems:
+            print("PocketPal stress: " + problem)
+
+        os.chdir(os.path.dirname(data_dir))
+        if errors or problems:
+            sys.exit(1)
+        print("PocketPal stress: passed")
+
+
+if __name__ == "__main__":
+    main()
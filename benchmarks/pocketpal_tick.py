@@ -0,0 +1,250 @@
+import argparse
+import os
+import statistics
+import sys
+from time import perf_counter
+
+import numpy as np
+
+
+"""
+Benchmark for PocketPal's simulation tick.
+Compares the vectorized PalStore.simulate with the per pal loop it replaced (Pal.simulate, copied below as it was)
+on the same randomized pals, and checks that both leave every pal with the same vitals after every tick.
+
+Run it from the Telegram-Response-Bot folder so the bot's plugin module can be imported:
+    python path/to/benchmarks/pocketpal_tick.py --pals 10000 100000
+"""
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from plugins.pocketpal import Food, Game, Growth, Mood, PalStore
+
+
+# Pal as it was before PalStore, one object per pal simulated one at a time
+class LegacyPal:
+    def __init__(self, species, dir, age, health, mood, hunger, clean, alive, received_attention):
+        self.age = age
+        self.health = health
+        self.mood = mood
+        self.hunger = hunger
+        self.clean = clean
+        self.growth = Growth.child.value
+        self.alive = alive
+        self.species = species
+        self.craving = Food.nothing
+        self.desire = Game.nothing
+        self.received_attention = received_attention
+        self.status_image = dir + "/assets/{}/tame.png".format(self.species)
+        self.dir = dir
+
+    def simulate(self):
+        if not self.alive:
+            return
+
+        if self.health <= 0:
+            self.alive = False
+            self.status_image = self.dir + "/assets/{}/dead.png".format(self.species)
+            return
+
+        self.clean -= 4
+        self.hunger -= 2
+        self.age += 1
+
+        if 75 <= self.hunger < 100:
+            self.health += 2
+        elif 50 <= self.hunger < 75:
+            self.health -= 1
+            self.hunger -= 1
+        elif 25 <= self.hunger < 50:
+            self.health -= 2
+            self.mood -= 1
+            self.hunger -= 2
+        elif 0 <= self.hunger < 25:
+            self.health -= 3
+            self.mood -= 1
+            self.hunger -= 2
+
+        if 95 <= self.clean < 100:
+            self.health += 2
+        elif 75 <= self.clean < 95:
+            self.health += 1
+        elif 50 <= self.clean < 75:
+            self.health -= 1
+            self.mood -= 1
+        elif 25 <= self.clean < 50:
+            self.health -= 2
+            self.mood -= 1
+            self.hunger -= 1
+        elif 0 <= self.clean < 25:
+            self.health -= 3
+            self.mood -= 1
+            self.hunger -= 1
+
+        if self.received_attention:
+            self.mood += 1
+        else:
+            self.mood -= 1
+
+        if self.mood > 9:
+            self.mood = 9
+        elif self.mood < 0:
+            self.mood = 0
+
+        if self.mood == Mood.elated.value:
+            self.health += 3
+            self.clean += 1
+            self.status_image = self.dir + "/assets/{}/elated.png".format(self.species)
+        elif self.mood == Mood.delighted.value:
+            self.health += 2
+            self.status_image = self.dir + "/assets/{}/delighted.png".format(self.species)
+        elif self.mood == Mood.happy.value:
+            self.health += 1
+            self.status_image = self.dir + "/assets/{}/happy.png".format(self.species)
+        elif self.mood == Mood.amused.value:
+            self.status_image = self.dir + "/assets/{}/amused.png".format(self.species)
+        elif self.mood == Mood.tame.value:
+            self.mood += 0
+            self.status_image = self.dir + "/assets/{}/tame.png".format(self.species)
+        elif self.mood == Mood.tired.value:
+            self.hunger -= 1
+            self.clean -= 1
+            self.status_image = self.dir + "/assets/{}/tired.png".format(self.species)
+        elif self.mood == Mood.sad.value:
+            self.health -= 1
+            self.hunger -= 2
+            self.clean -= 3
+            self.status_image = self.dir + "/assets/{}/sad.png".format(self.species)
+        elif self.mood == Mood.depressed.value:
+            self.health -= 2
+            self.hunger -= 2
+            self.clean -= 2
+            self.status_image = self.dir + "/assets/{}/depressed.png".format(self.species)
+        elif self.mood == Mood.dejected.value:
+            self.health -= 3
+            self.hunger -= 3
+            self.clean -= 3
+            self.status_image = self.dir + "/assets/{}/dejected.png".format(self.species)
+        elif self.mood == Mood.defeated.value:
+            self.health -= 5
+            self.hunger -= 4
+            self.clean -= 4
+            self.status_image = self.dir + "/assets/{}/defeated.png".format(self.species)
+
+        if self.mood > 9:
+            self.mood = 9
+        elif self.mood < 0:
+            self.mood = 0
+
+        if self.health > 100:
+            self.health = 100
+
+        if self.clean > 100:
+            self.clean = 100
+        elif self.clean < 0:
+            self.clean = 0
+
+        if self.hunger > 100:
+            self.hunger = 100
+        elif self.hunger < 0:
+            self.hunger = 0
+
+        if self.age < 288:
+            self.growth = Growth.child.value
+        elif self.age < 864:
+            self.growth = Growth.teen.value
+        elif self.age < 2016:
+            self.growth = Growth.adult.value
+        else:
+            self.growth = Growth.ascended.value
+
+        self.craving = Food.rand_food()
+        self.desire = Game.rand_game()
+        self.received_attention = False
+
+
+def make_pals(count, seed):
+    """
+    Builds the same randomized pals both ways
+    :param count: the amount of pals
+    :param seed: seed for their vitals
+    :return: (PalStore, array of each pal's row in it, list of LegacyPal)
+    """
+
+    rng = np.random.RandomState(seed)
+    vitals = {"age": rng.randint(0, 2500, count), "health": rng.randint(-5, 101, count),
+              "mood": rng.randint(0, 10, count), "hunger": rng.randint(0, 101, count),
+              "clean": rng.randint(0, 101, count)}
+    alive = rng.rand(count) < 0.95
+    attention = rng.rand(count) < 0.3
+
+    store = PalStore(capacity=count)
+    for x in range(count):
+        store.add("user{}".format(x), "pal", "cat")
+    rows = np.array([store.owners["user{}".format(x)] for x in range(count)])
+    for field, values in vitals.items():
+        getattr(store, field)[rows] = values
+    store.alive[rows] = alive
+    store.attention[rows] = attention
+
+    pals = [LegacyPal("cat", ".", *(int(vitals[field][x]) for field in ("age", "health", "mood", "hunger", "clean")),
+                      bool(alive[x]), bool(attention[x])) for x in range(count)]
+    return store, rows, pals
+
+
+def compare(store, rows, pals):
+    """
+    Growth isn't compared since PalStore derives it from age
+    :return: the names of the vitals that differ between the store and the legacy pals
+    """
+
+    different = []
+    for field in ("age", "health", "mood", "hunger", "clean", "alive"):
+        if not np.array_equal(getattr(store, field)[rows], np.array([getattr(pal, field) for pal in pals])):
+            different.append(field)
+    return different
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the vectorized pal tick with the per pal loop")
+    parser.add_argument("--pals", type=int, nargs="+", default=[10000, 100000], help="pal counts to measure")
+    parser.add_argument("--ticks", type=int, default=10, help="ticks simulated, and compared, per count")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the pals' vitals")
+    args = parser.parse_args()
+
+    failed = False
+    for count in args.pals:
+        store, rows, pals = make_pals(count, args.seed)
+        loop_times = []
+        vectorized_times = []
+
+        for tick in range(args.ticks):
+            start = perf_counter()
+            for pal in pals:
+                pal.simulate()
+            loop_times.append(perf_counter() - start)
+
+            start = perf_counter()
+            store.simulate()
+            vectorized_times.append(perf_counter() - start)
+
+            different = compare(store, rows, pals)
+            if different:
+                print("Tick benchmark: {} pals differ in {} after tick {}".format(count, ", ".join(different),
+                                                                                   tick + 1))
+                failed = True
+                break
+
+        loop = statistics.median(loop_times) * 1000
+        vectorized = statistics.median(vectorized_times) * 1000
+        print("Tick benchmark: {} pals, loop {:.1f}ms, vectorized {:.1f}ms per tick ({:.0f}x), {} ticks".format(
+            count, loop, vectorized, loop / vectorized, len(loop_times)))
+
+    if failed:
+        sys.exit(1)
+    print("Tick benchmark: vitals matched")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import heapq
+import os
+import re
+import statistics
+import sys
+from time import perf_counter
+
+import numpy as np
+
+
+"""
+Benchmark for urlsummary's sentence scoring on large articles.
+Times the scoring loop summarize_article used to run (copied below as it was) against FrequencySummarizer,
+on synthetic articles of growing length, and prints the cost per sentence so it is easy to see both stay linear.
+Both are given the same sentences, so only scoring is timed and not html parsing or sentence splitting.
+Their picks can differ slightly since the old loop counted capitalised words separately.
+
+Uses NLTK's word tokenizer and stopwords when their data is installed, otherwise the Treebank tokenizer
+(which needs no data) and a short built in stopword list, so the benchmark can still run.
+    python path/to/benchmarks/summarizer_scoring.py --sentences 250 1000 4000 16000
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import nltk
+
+from libs.summarizers import FrequencySummarizer
+
+
+fallback_stopwords = ["i", "me", "my", "we", "our", "you", "your", "he", "him", "his", "she", "her", "it", "its",
+                      "they", "them", "their", "what", "which", "who", "this", "that", "these", "those", "am", "is",
+                      "are", "was", "were", "be", "been", "being", "have", "has", "had", "do", "does", "did", "a",
+                      "an", "the", "and", "but", "if", "or", "because", "as", "until", "while", "of", "at", "by",
+                      "for", "with", "about", "against", "between", "into", "through", "during", "before", "after",
+                      "above", "below", "to", "from", "up", "down", "in", "out", "on", "off", "over", "under",
+                      "again", "then", "once", "here", "there", "when", "where", "why", "how", "all", "any", "both",
+                      "each", "few", "more", "most", "other", "some", "such", "no", "nor", "not", "only", "own",
+                      "same", "so", "than", "too", "very", "can", "will", "just", "should", "now"]
+
+
+def load_tokenizer():
+    """
+    :return: (word tokenizer, stopword list, description of what was loaded)
+    """
+
+    try:
+        nltk.word_tokenize("Check the punkt model is installed.")
+        word_tokenize = nltk.word_tokenize
+        tokenizer = "nltk.word_tokenize"
+    except LookupError:
+        word_tokenize = nltk.tokenize.TreebankWordTokenizer().tokenize
+        tokenizer = "Treebank tokenizer (punkt isn't installed)"
+
+    try:
+        stopwords = nltk.corpus.stopwords.words('english')
+        source = "NLTK stopwords"
+    except LookupError:
+        stopwords = list(fallback_stopwords)
+        source = "built in stopwords (NLTK's aren't installed)"
+    return word_tokenize, stopwords, "{}, {}".format(tokenizer, source)
+
+
+def legacy_scoring(sentence_list, stopwords, word_tokenize):
+    """
+    The scoring summarize_article ran before it was rewritten, from the formatted text up to picking five sentences.
+    The stopword list is passed in as the list NLTK returns, it was loaded on every call.
+    """
+
+    article_text = " ".join(sentence_list)
+    formatted_article_text = re.sub('[^a-zA-Z]', ' ', article_text)
+    formatted_article_text = re.sub(r'\s+', ' ', formatted_article_text)
+
+    word_frequencies = {}
+    for word in word_tokenize(formatted_article_text):
+        if word not in stopwords:
+            if word not in word_frequencies.keys():
+                word_frequencies[word] = 1
+            else:
+                word_frequencies[word] += 1
+
+    maximum_frequncy = max(word_frequencies.values())
+
+    for word in word_frequencies.keys():
+        word_frequencies[word] = (word_frequencies[word]/maximum_frequncy)
+
+    sentence_scores = {}
+    for sent in sentence_list:
+        for word in word_tokenize(sent.lower()):
+            if word in word_frequencies.keys():
+                if len(sent.split(' ')) < 30:
+                    if sent not in sentence_scores.keys():
+                        sentence_scores[sent] = word_frequencies[word]
+                    else:
+                        sentence_scores[sent] += word_frequencies[word]
+
+    return heapq.nlargest(5, sentence_scores, key=sentence_scores.get)
+
+
+def make_sentences(count, seed):
+    """
+    :param count: the amount of sentences
+    :param seed: seed for the words picked
+    :return: a list of sentences whose words follow a Zipf distribution, mixed with common stopwords
+    """
+
+    rng = np.random.RandomState(seed)
+    vocabulary = ["word{}".format(chr(97 + x % 26) * (1 + x // 26)) for x in range(5000)]
+    sentences = []
+    for x in range(count):
+        length = rng.randint(6, 40)
+        words = [vocabulary[min(rank, len(vocabulary)) - 1] if rng.rand() < 0.6 else fallback_stopwords[rank % 40]
+                 for rank in rng.zipf(1.3, length)]
+        sentences.append(" ".join(words).capitalize() + ".")
+    return sentences
+
+
+def median_time(function, runs):
+    times = []
+    for x in range(runs):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the old and new summary scoring on large articles")
+    parser.add_argument("--sentences", type=int, nargs="+", default=[250, 1000, 4000, 16000],
+                        help="article lengths to measure, in sentences")
+    parser.add_argument("--runs", type=int, default=3, help="runs per length, the median is reported")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic articles")
+    args = parser.parse_args()
+
+    word_tokenize, stopwords, description = load_tokenizer()
+    print("Scoring benchmark: using {}".format(description))
+
+    for count in args.sentences:
+        sentences = make_sentences(count, args.seed)
+        words = sum(len(sentence.split(' ')) for sentence in sentences)
+
+        legacy = median_time(lambda: legacy_scoring(sentences, stopwords, word_tokenize), args.runs)
+        # The summarizer is built per run since the old code loaded its stopwords on every call as well
+        current = median_time(lambda: FrequencySummarizer(stopwords).summarize(sentences), args.runs)
+
+        print("Scoring benchmark: {} sentences ({} words), old {:.1f}ms ({:.1f}us/sentence), new {:.1f}ms "
+              "({:.1f}us/sentence), {:.1f}x".format(count, words, legacy * 1000, legacy * 1e6 / count,
+                                                    current * 1000, current * 1e6 / count, legacy / current))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+"""
+Startup benchmark for the urlsummary plugin.
+Every measurement runs in a fresh interpreter, since imports and NLTK models are only ever loaded once per process:
+    import      how long importing plugins.urlsummary takes, which is what bot startup pays for
+    cold        the first summarize_article when the plugin was never warmed up
+    warm        warm_up itself, then the first summarize_article after it finished
+NLTK's punkt and stopwords data must be installed (nltk.download("punkt") and nltk.download("stopwords")).
+
+Run it from the Telegram-Response-Bot folder so the bot's plugin module can be imported:
+    python path/to/benchmarks/urlsummary_startup.py --runs 5
+"""
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Run by every child process, the last line it prints is a JSON dict of timings in milliseconds
+child = """
+import json, sys
+from time import perf_counter
+sys.path[:0] = {paths!r}
+
+start = perf_counter()
+import plugins.urlsummary
+timings = {{"import": (perf_counter() - start) * 1000}}
+
+if {scenario!r} != "import":
+    warm_up = plugins.urlsummary.Summary.warm_up
+    # Keeps the plugin from warming itself up in the background while it is being timed
+    plugins.urlsummary.Summary.warm_up = lambda self: None
+    summary = plugins.urlsummary.Summary({data_dir!r}, None)
+
+    if {scenario!r} == "warm":
+        start = perf_counter()
+        warm_up(summary)
+        timings["warm_up"] = (perf_counter() - start) * 1000
+
+    with open({article!r}, "rb") as f:
+        article = f.read()
+    start = perf_counter()
+    summary.summarize_article(article)
+    timings["first_summary"] = (perf_counter() - start) * 1000
+
+print(json.dumps(timings))
+"""
+
+
+def make_article(paragraphs):
+    """
+    :param paragraphs: the amount of paragraphs in the article
+    :return: the raw html of an article made of plain english sentences
+    """
+
+    subjects = ["The market", "Our reporter", "The committee", "A local bakery", "The river", "Every student"]
+    verbs = ["announced", "questioned", "reviewed", "celebrated", "ignored", "measured"]
+    objects = ["the new policy", "a surprising result", "the old bridge", "its quarterly numbers", "the weather"]
+    sentences = ["{} {} {} on day {}.".format(subjects[x % len(subjects)], verbs[x % len(verbs)],
+                                             objects[x % len(objects)], x) for x in range(paragraphs * 6)]
+    body = "".join("<p>{}</p>".format(" ".join(sentences[x:x + 6])) for x in range(0, len(sentences), 6))
+    return "<html><body><h1>Benchmark</h1>{}</body></html>".format(body).encode()
+
+
+def measure(scenario, data_dir, article):
+    """
+    :param scenario: "import", "cold" or "warm"
+    :param data_dir: directory the plugin keeps summary.json in
+    :param article: path of the html file to summarize
+    :return: dict of timing names to milliseconds from one fresh interpreter
+    """
+
+    code = child.format(paths=[os.getcwd(), root], scenario=scenario, data_dir=data_dir, article=article)
+    result = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError("the {} run failed:\n{}".format(scenario, result.stderr))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure urlsummary import time and first request latency")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters started per scenario")
+    parser.add_argument("--paragraphs", type=int, default=200, help="paragraphs in the summarized article")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        article = os.path.join(data_dir, "article.html")
+        with open(article, "wb") as f:
+            f.write(make_article(args.paragraphs))
+
+        for scenario in ("import", "cold", "warm"):
+            try:
+                runs = [measure(scenario, data_dir, article) for x in range(args.runs)]
+            except RuntimeError as e:
+                print("Startup benchmark: {}".format(e))
+                sys.exit(1)
+
+            medians = ", ".join("{} {:.1f}ms".format(name, statistics.median(run[name] for run in runs))
+                                for name in runs[0].keys())
+            print("Startup benchmark: {:<6} (median of {}) {}".format(scenario, args.runs, medians))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import random
+
+
+"""
+Mixin giving Enums constant time name lookups and random picks.
+Usage: class Food(EnumLookup, Enum)
+The name -> member dict and member tuple are built the first time they are needed and reused afterwards.
+"""
+
+
+class EnumLookup:
+    @classmethod
+    def lookup_table(cls):
+        """
+        :return: a dict of member names to members, cached on the Enum class
+        """
+
+        table = cls.__dict__.get("_lookup_table")
+        if table is None:
+            table = {member.name: member for member in cls}
+            type.__setattr__(cls, "_lookup_table", table)
+        return table
+
+    @classmethod
+    def member_tuple(cls):
+        """
+        :return: a tuple of every member in definition order, cached on the Enum class
+        """
+
+        members = cls.__dict__.get("_member_tuple")
+        if members is None:
+            members = tuple(cls)
+            type.__setattr__(cls, "_member_tuple", members)
+        return members
+
+    @classmethod
+    def has_name(cls, name):
+        return name in cls.lookup_table()
+
+    @classmethod
+    def from_name(cls, name):
+        """
+        :param name: name of a member
+        :return: the member with that name, or None if there isn't one
+        """
+
+        return cls.lookup_table().get(name)
+
+    @classmethod
+    def random_member(cls):
+        return random.choice(cls.member_tuple())
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import threading
+
+
+"""
+Remembers the Telegram file_id of every image a plugin has uploaded.
+Images are identified by their content hash, so each distinct image is only ever uploaded once.
+Later sends of the same image reference the file_id instead of re-uploading the bytes.
+"""
+
+
+class MediaCache:
+    def __init__(self, path):
+        self.dir = path
+        # Dict composed of file paths as keys and their last seen size, mtime and content hash as values
+        self.paths = {}
+        # Dict composed of content hashes as keys and Telegram file_ids as values
+        self.file_ids = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def content_hash(self, file_name):
+        """
+        Hashes an image, reusing the previous hash while the file's size and mtime are unchanged
+        :param file_name: path to the image
+        :return: the sha1 hex digest of the image
+        """
+
+        stat = os.stat(file_name)
+        entry = self.paths.get(file_name)
+
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["hash"]
+
+        sha = hashlib.sha1()
+        with open(file_name, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                sha.update(chunk)
+            f.close()
+
+        self.paths[file_name] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": sha.hexdigest()}
+        return self.paths[file_name]["hash"]
+
+    def get_file_id(self, file_name):
+        """
+        :param file_name: path to the image
+        :return: the file_id of a previous upload of this image, or None if it has not been uploaded
+        """
+
+        with self.lock:
+            return self.file_ids.get(self.content_hash(file_name))
+
+    def send_photo(self, bot, chat_id, file_name, caption=""):
+        """
+        Sends an image to a chat, uploading it only if no file_id is known for its contents
+        :param bot: the bot whose send_photo is used
+        :param chat_id: chat to send the image to
+        :param file_name: path to the image
+        :param caption: caption shown under the image
+        :return: the message returned by the bot
+        """
+
+        with self.lock:
+            digest = self.content_hash(file_name)
+            file_id = self.file_ids.get(digest)
+
+        if file_id is not None:
+            try:
+                return bot.send_photo(chat_id, file_id, caption=caption)
+            except Exception as e:
+                # Telegram may reject a file_id it no longer recognizes, fall back to uploading again
+                print("MediaCache: Cached file_id for {} was rejected ({}), uploading again.".format(file_name, e))
+
+        with open(file_name, "rb") as f:
+            message = bot.send_photo(chat_id, f, caption=caption)
+            f.close()
+
+        with self.lock:
+            self.file_ids[digest] = message.photo[-1].file_id
+            self.save()
+        return message
+
+    def save(self):
+        with open(self.dir, "w+") as f:
+            json.dump({"paths": self.paths, "file_ids": self.file_ids}, f, sort_keys=True, indent=4)
+            f.close()
+
+    def load(self):
+        try:
+            with open(self.dir, "r") as f:
+                data = json.load(f)
+                self.paths = data["paths"]
+                self.file_ids = data["file_ids"]
+                f.close()
+        except FileNotFoundError:
+            print("MediaCache: No media cache exists, creating a new one.")
+        except (ValueError, KeyError):
+            print("MediaCache: Unable to read {}, starting with an empty cache.".format(self.dir))
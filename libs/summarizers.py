@@ -0,0 +1,225 @@
+import heapq
+import math
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+
+"""
+Extractive summarizers that pick the most representative sentences out of a document.
+Every backend shares one interface: summarize() for a single document and summarize_batch() for many,
+where the statistics a backend needs are computed once across the whole batch.
+The TextRank backend needs NumPy and SciPy, load_summarizer falls back to word frequencies without them.
+"""
+
+
+class Summarizer:
+    name = None
+    # Words are runs of letters
+    word_pattern = re.compile('[a-z]+')
+
+    def __init__(self, stopwords=frozenset(), max_words=30):
+        """
+        :param stopwords: words that are never counted
+        :param max_words: sentences with at least this many words are never picked
+        """
+
+        self.stopwords = frozenset(stopwords)
+        self.max_words = max_words
+
+    def tokenize(self, sentence):
+        return [word for word in self.word_pattern.findall(sentence.lower()) if word not in self.stopwords]
+
+    def summarize(self, sentences, count=5):
+        """
+        :param sentences: the sentences of a document
+        :param count: the most sentences to pick
+        :return: a list of the picked sentences
+        """
+
+        return self.summarize_batch([sentences], count)[0]
+
+    def summarize_batch(self, documents, count=5, processes=None):
+        """
+        Summarizes many documents in one call. Every document is tokenized once and shared statistics are fit
+        over all of them before any document is ranked.
+        :param documents: a list of documents, each a list of sentences
+        :param count: the most sentences to pick per document
+        :param processes: rank documents in a pool of this many processes, or in this process if None
+        :return: a list holding the picked sentences of each document
+        """
+
+        tokens = [[self.tokenize(sentence) for sentence in sentences] for sentences in documents]
+        rank = partial(self.rank, count=count, statistics=self.fit(tokens))
+
+        if processes is not None and len(documents) > 1:
+            with ProcessPoolExecutor(processes) as pool:
+                return list(pool.map(rank, documents, tokens, chunksize=max(1, len(documents) // (processes * 4))))
+        return [rank(sentences, sentence_tokens) for sentences, sentence_tokens in zip(documents, tokens)]
+
+    def fit(self, tokens):
+        """
+        :param tokens: the tokens of every sentence of every document in a batch
+        :return: statistics shared by every document in the batch, passed on to rank
+        """
+
+        return None
+
+    def rank(self, sentences, tokens, count, statistics):
+        """
+        :param sentences: the sentences of a document
+        :param tokens: the tokens of each sentence
+        :param count: the most sentences to pick
+        :param statistics: the result of fit
+        :return: a list of the picked sentences
+        """
+
+        raise NotImplementedError
+
+
+class FrequencySummarizer(Summarizer):
+    name = "frequency"
+
+    def rank(self, sentences, tokens, count, statistics):
+        """
+        Scores each sentence by how frequent its words are across the document, best first
+        """
+
+        word_frequencies = Counter()
+        for sentence_tokens in tokens:
+            word_frequencies.update(sentence_tokens)
+
+        if len(word_frequencies) == 0:
+            return []
+        maximum_frequency = max(word_frequencies.values())
+
+        sentence_scores = {}
+        for sentence, sentence_tokens in zip(sentences, tokens):
+            if len(sentence_tokens) > 0 and len(sentence.split(' ')) < self.max_words:
+                score = sum(word_frequencies[word] for word in sentence_tokens) / maximum_frequency
+                sentence_scores[sentence] = sentence_scores.get(sentence, 0) + score
+
+        return heapq.nlargest(count, sentence_scores, key=sentence_scores.get)
+
+
+class TextRankSummarizer(Summarizer):
+    name = "textrank"
+
+    def __init__(self, stopwords=frozenset(), max_words=30, damping=0.85, iterations=100, tolerance=1e-6):
+        """
+        :param damping: chance the random walk follows a similarity edge rather than jumping to any sentence
+        :param iterations: the most power iterations run per document
+        :param tolerance: stop iterating once the scores move less than this in total
+        """
+
+        if sparse is None:
+            raise ImportError("TextRankSummarizer requires numpy and scipy")
+
+        super().__init__(stopwords, max_words)
+        self.damping = damping
+        self.iterations = iterations
+        self.tolerance = tolerance
+
+    def fit(self, tokens):
+        """
+        Builds the vocabulary and smoothed inverse document frequencies, treating every sentence in the
+        batch as a document
+        :return: (dict of words to columns, array of idf weights by column)
+        """
+
+        document_frequency = Counter()
+        sentence_count = 0
+        for document in tokens:
+            for sentence_tokens in document:
+                document_frequency.update(set(sentence_tokens))
+                sentence_count += 1
+
+        vocabulary = {}
+        idf = np.empty(len(document_frequency))
+        for column, (word, frequency) in enumerate(document_frequency.items()):
+            vocabulary[word] = column
+            idf[column] = math.log((1 + sentence_count) / (1 + frequency)) + 1
+        return vocabulary, idf
+
+    def rank(self, sentences, tokens, count, statistics):
+        """
+        Ranks sentences with PageRank over their TF-IDF cosine similarity graph.
+        Picked sentences are returned in the order they appear in the document.
+        """
+
+        vocabulary, idf = statistics
+        size = len(sentences)
+        if size == 0:
+            return []
+
+        rows = []
+        columns = []
+        data = []
+        for row, sentence_tokens in enumerate(tokens):
+            for word, frequency in Counter(sentence_tokens).items():
+                rows.append(row)
+                columns.append(vocabulary[word])
+                data.append(frequency * idf[vocabulary[word]])
+
+        tfidf = sparse.csr_matrix((data, (rows, columns)), shape=(size, len(vocabulary)))
+        norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        tfidf = sparse.diags(1 / norms) @ tfidf
+
+        similarity = (tfidf @ tfidf.T).tolil()
+        similarity.setdiag(0)
+        similarity = similarity.tocsr()
+        similarity.eliminate_zeros()
+
+        # Row normalize into a transition matrix, sentences without edges spread their score evenly
+        out_weight = np.asarray(similarity.sum(axis=1)).ravel()
+        dangling = out_weight == 0
+        out_weight[dangling] = 1
+        transition = (sparse.diags(1 / out_weight) @ similarity).T.tocsr()
+
+        scores = np.full(size, 1 / size)
+        for x in range(self.iterations):
+            updated = (1 - self.damping) / size + self.damping * (transition @ scores + scores[dangling].sum() / size)
+            converged = np.abs(updated - scores).sum() < self.tolerance
+            scores = updated
+            if converged:
+                break
+
+        picked = []
+        seen = set()
+        for index in np.argsort(-scores, kind="stable"):
+            sentence = sentences[index]
+            if len(tokens[index]) > 0 and len(sentence.split(' ')) < self.max_words and sentence not in seen:
+                seen.add(sentence)
+                picked.append(index)
+                if len(picked) == count:
+                    break
+        return [sentences[index] for index in sorted(picked)]
+
+
+# Dict composed of backend names as keys and their Summarizer class as values
+summarizers = {FrequencySummarizer.name: FrequencySummarizer, TextRankSummarizer.name: TextRankSummarizer}
+
+
+def load_summarizer(name, stopwords=frozenset()):
+    """
+    :param name: name of a backend in summarizers
+    :param stopwords: words that are never counted
+    :return: a Summarizer, falling back to word frequencies if the backend is unknown or can't be loaded
+    """
+
+    try:
+        return summarizers[name](stopwords)
+    except KeyError:
+        print("Summarizers: Unknown backend {}, using word frequencies.".format(name))
+    except ImportError as e:
+        print("Summarizers: Unable to load {} ({}), using word frequencies.".format(name, e))
+    return FrequencySummarizer(stopwords)
@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+"""
+A thread safe least recently used cache whose entries also expire after a fixed amount of time.
+Once the cache is full, adding an entry evicts whichever entry was used longest ago.
+"""
+
+
+class TTLCache:
+    def __init__(self, max_size, ttl):
+        """
+        :param max_size: the most entries kept at once
+        :param ttl: seconds an entry stays valid after it is added
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        # OrderedDict composed of keys and (expiry time, value) tuples, least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        :param key: key of the entry
+        :param default: returned when there is no entry or it has expired
+        :return: the cached value, or default
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= monotonic():
+                del self.entries[key]
+                return default
+
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        """
+        Adds or replaces an entry, evicting the least recently used entries if the cache is full
+        :param key: key of the entry
+        :param value: value to cache
+        """
+
+        with self.lock:
+            self.entries[key] = (monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.entries)
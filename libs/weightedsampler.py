@@ -0,0 +1,146 @@
+import json
+import os
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+"""
+Weighted random sampling for loot tables.
+Weights are compiled once with Vose's alias method so every draw is O(1).
+Batched draws use NumPy when it is installed and fall back to plain Python otherwise.
+"""
+
+
+class AliasSampler:
+    def __init__(self, weights):
+        """
+        Compiles a list of weights into probability and alias tables
+        :param weights: non-negative numbers, at least one of which is positive
+        """
+
+        self.size = len(weights)
+        total = float(sum(weights))
+
+        if self.size == 0 or total <= 0 or min(weights) < 0:
+            raise ValueError("AliasSampler: weights must be non-negative and sum to a positive value")
+
+        scaled = [weight * self.size / total for weight in weights]
+        self.prob = [0.0] * self.size
+        self.alias = [0] * self.size
+
+        small = [i for i in range(self.size) if scaled[i] < 1.0]
+        large = [i for i in range(self.size) if scaled[i] >= 1.0]
+
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = (scaled[more] + scaled[less]) - 1.0
+
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+        # Anything left over is only off by floating point error and always keeps its own column
+        for i in large + small:
+            self.prob[i] = 1.0
+            self.alias[i] = i
+
+        if np is not None:
+            self.np_prob = np.array(self.prob)
+            self.np_alias = np.array(self.alias)
+
+    def draw(self):
+        """
+        Draws a single index in O(1)
+        :return: an index into the original weights
+        """
+
+        column = random.randrange(self.size)
+        if random.random() < self.prob[column]:
+            return column
+        return self.alias[column]
+
+    def draw_many(self, count):
+        """
+        Draws several indices at once
+        :param count: the number of indices to draw
+        :return: a list of indices into the original weights
+        """
+
+        if np is None:
+            return [self.draw() for x in range(count)]
+
+        columns = np.random.randint(0, self.size, size=count)
+        coins = np.random.random_sample(count)
+        return np.where(coins < self.np_prob[columns], columns, self.np_alias[columns]).tolist()
+
+
+class LootTable:
+    def __init__(self, weights):
+        """
+        Precompiles a table of outcomes into an AliasSampler
+        Outcomes with a weight of zero can never be drawn
+        :param weights: dict of outcome names to their relative weights
+        """
+
+        self.weights = dict(weights)
+        self.outcomes = list(self.weights.keys())
+        self.sampler = AliasSampler([self.weights[outcome] for outcome in self.outcomes])
+
+    def roll(self):
+        """
+        :return: a single randomly drawn outcome name
+        """
+
+        return self.outcomes[self.sampler.draw()]
+
+    def roll_many(self, count):
+        """
+        :param count: the number of outcomes to draw
+        :return: a list of randomly drawn outcome names
+        """
+
+        return [self.outcomes[i] for i in self.sampler.draw_many(count)]
+
+    def restrict(self, outcomes):
+        """
+        Builds a new table holding only the given outcomes, keeping their weights
+        :param outcomes: outcome names that may still be drawn
+        :return: a new LootTable
+        """
+
+        return LootTable({outcome: self.weights[outcome] for outcome in self.outcomes if outcome in outcomes})
+
+
+def load_weights(path, defaults):
+    """
+    Loads loot table weights from a json file so drop rates can be tuned without code changes.
+    Creates the file from the defaults if one isn't found.
+    :param path: location of the json file
+    :param defaults: weights to use and save when the file is missing
+    :return: the loaded weights
+    """
+
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, "w+") as f:
+            json.dump(defaults, f, indent=4)
+        print("WeightedSampler: No loot table found at {}, creating a new one.".format(path))
+        return defaults
+    except ValueError:
+        print("WeightedSampler: Unable to parse {}, using default drop rates.".format(path))
+        return defaults
+
@@ -1,8 +1,11 @@
 import os
 import pickle
 import random
+import threading
 
 from libs.honorbank import HonorBank
+from libs.mediacache import MediaCache
+from libs.weightedsampler import LootTable, load_weights
 from plugin import Plugin
 
 
@@ -29,6 +32,8 @@ class CafeGacha(Plugin):
         self.accounts = HonorBank()
         #
         self.gacha_manager = GachaManager(self.dir)
+        # Remembers uploaded art so each image is only sent to Telegram once
+        self.media_cache = MediaCache(self.dir + "/media_cache.json")
 
     def com_summon(self, command):
         user = command.user.username
@@ -42,7 +47,6 @@ class CafeGacha(Plugin):
 
         if self.accounts.get_funds(user) >= honor_spent:
             modifier = int(honor_spent / 1000)
-            self.accounts.charge(user, honor_spent)
 
             if modifier > 3:
                 modifier = 3
@@ -50,6 +54,10 @@ class CafeGacha(Plugin):
                 modifier = 0
 
             new_gacha = self.gacha_manager.pick_gacha(modifier)
+            if new_gacha is None:
+                return {"type": "message", "message": "CafeGacha: There are no minions available to summon!"}
+
+            self.accounts.charge(user, honor_spent)
             self.gacha_manager.give_gacha(new_gacha, user)
             return {"type": "photo", "caption": "CafeGacha: You summoned {}".format(new_gacha.name), "file_name": new_gacha.uri}
         return {"type": "message", "message": "CafeGacha: You do not possess {} honor!".format(honor_spent)}
@@ -57,7 +65,10 @@ class CafeGacha(Plugin):
     def com_view(self, command):
         gacha_name = command.args
         gacha = self.gacha_manager.get_gacha(gacha_name)
-        return gacha.uri
+
+        if gacha is None:
+            return {"type": "message", "message": "CafeGacha: {} does not exist!".format(gacha_name)}
+        return {"type": "photo", "caption": "", "file_name": gacha.uri}
 
     def com_list(self, command):
         user = command.user.username
@@ -79,12 +90,19 @@ class CafeGacha(Plugin):
             return "CafeGacha: Successfully traded your {} to {}".format(gacha_name, user_to)
         return "CafeGacha: Trade failed! Either you do not possess enough of that gacha, or that user isn't currently playing this game... "
 
+    # Sends photo responses through the media cache, other responses are returned to the bot as usual
+    def send_response(self, command, response):
+        if response["type"] == "photo":
+            self.media_cache.send_photo(self.bot, command.chat.id, response["file_name"], response["caption"])
+            return None
+        return response
+
     # Run whenever someone on telegram types one of these commands
     def on_command(self, command):
         if command.command == "gsummon":
-            return self.com_summon(command)
+            return self.send_response(command, self.com_summon(command))
         elif command.command == "gview":
-            return {"type": "photo", "caption": "", "file_name": self.com_view(command)}
+            return self.send_response(command, self.com_view(command))
         elif command.command == "glist":
             return {"type": "message", "message": self.com_list(command)}
         elif command.command == "gtrade":
@@ -107,35 +125,108 @@ class CafeGacha(Plugin):
 
 
 class GachaManager():
+    rarities = ["Bronze", "Silver", "Gold"]
+
     def __init__(self, dir):
         self.dir = dir
         self.player_db = {}
         self.load()
-        self.bronze_list = self.build_gacha("Bronze")
-        self.silver_list = self.build_gacha("Silver")
-        self.gold_list = self.build_gacha("Gold")
-
+        # Dict composed of gacha names as keys and Gacha objs as values, built from the buckets by build_index
+        self.gacha_index = {}
+        # Dict composed of rarities as keys and lists of Gacha objs as values
+        self.rarity_buckets = {rarity: [] for rarity in self.rarities}
+        # Last seen modification time of each rarity folder, art is only discovered once it is first needed
+        self.folder_mtimes = {rarity: -1 for rarity in self.rarities}
+        self.rarity_weights = self.load_rarity_weights()
+        self.rarity_tables = {}
+        self.lock = threading.RLock()
+
+    # Rescans any rarity folder that changed since it was last seen so new art is picked up without a restart
+    def refresh(self):
+        with self.lock:
+            changed = False
+
+            for rarity in self.rarities:
+                try:
+                    mtime = os.stat(self.dir + "/" + rarity).st_mtime_ns
+                except OSError:
+                    mtime = None
+
+                if mtime != self.folder_mtimes[rarity]:
+                    self.folder_mtimes[rarity] = mtime
+                    self.build_gacha(rarity)
+                    changed = True
+
+            if changed:
+                self.build_index()
+                self.build_rarity_tables()
+
+    # Updates the bucket of a rarity, only creating Gacha objs for newly added art
     def build_gacha(self, rarity):
-        try:
-            new_list = []
+        found = {}
 
+        try:
             for file in os.listdir(self.dir + "/" + rarity):
                 if file.endswith(".png"):
-                    new_list.append(Gacha(file.split(".")[0], self.dir + "/" + rarity + "/" + file))
-            return new_list
-        except NotADirectoryError:
-            print("CafeGacha: No data could be loaded!")
-            return new_list
+                    found[file.split(".")[0]] = self.dir + "/" + rarity + "/" + file
+        except OSError:
+            print("CafeGacha: No {} data could be loaded!".format(rarity))
+
+        # Only this rarity's own Gacha objs are reused, a name shared with another rarity keeps its own art
+        existing = {gacha.name: gacha for gacha in self.rarity_buckets[rarity]}
+
+        new_bucket = []
+        for name in found.keys():
+            if name not in existing:
+                existing[name] = Gacha(name, found[name])
+            new_bucket.append(existing[name])
+        self.rarity_buckets[rarity] = new_bucket
+
+    # Rebuilds the name index from every bucket
+    # Players own gachas by name, so a name found in several rarities is looked up in the lowest rarity holding it
+    def build_index(self):
+        self.gacha_index = {}
+
+        for rarity in self.rarities:
+            for gacha in self.rarity_buckets[rarity]:
+                if gacha.name in self.gacha_index:
+                    print("CafeGacha: {} exists in more than one rarity, only {} is used by /gview!".format(
+                        gacha.name, self.gacha_index[gacha.name].uri))
+                else:
+                    self.gacha_index[gacha.name] = gacha
+
+    # Loads one rarity table per summon modifier (1000 honor spent per level)
+    # Each level moves 10% of the odds from bronze to gold, tunable through loot/cafegacha.json
+    def load_rarity_weights(self):
+        defaults = {
+            "0": {"Bronze": 75, "Silver": 22, "Gold": 3},
+            "1": {"Bronze": 65, "Silver": 22, "Gold": 13},
+            "2": {"Bronze": 55, "Silver": 22, "Gold": 23},
+            "3": {"Bronze": 45, "Silver": 22, "Gold": 33}
+        }
+        weights = load_weights(self.dir + "/loot/cafegacha.json", defaults)
+        rarity_weights = {}
+
+        for modifier in defaults.keys():
+            rarity_weights[int(modifier)] = LootTable(weights.get(modifier, defaults[modifier]))
+        return rarity_weights
+
+    # Precompiles the rarity tables, leaving out rarities that currently have no art
+    def build_rarity_tables(self):
+        available = [rarity for rarity in self.rarities if len(self.rarity_buckets[rarity]) > 0]
+        self.rarity_tables = {}
+
+        if len(available) > 0:
+            for modifier in self.rarity_weights.keys():
+                self.rarity_tables[modifier] = self.rarity_weights[modifier].restrict(available)
 
     def pick_gacha(self, modifier):
-        draw_chance = random.randint(0,99) + (modifier * 10)
+        self.refresh()
 
-        if 0 <= draw_chance < 75: # 75% chance at bronze
-            return random.choice(self.bronze_list)
-        elif 75 <= draw_chance < 97: # 22% chance of silver
-            return random.choice(self.silver_list)
-        else: # 3% chance of gold
-            return random.choice(self.gold_list)
+        with self.lock:
+            if modifier not in self.rarity_tables:
+                return None
+            return random.choice(self.rarity_buckets[self.rarity_tables[modifier].roll()])
 
     def give_gacha(self, gacha, username):
         if not username in self.player_db.keys():
@@ -148,18 +239,8 @@ class GachaManager():
         self.save()
 
     def get_gacha(self, name):
-        for item in self.bronze_list:
-            if item.name == name:
-                return item
-
-        for item in self.silver_list:
-            if item.name == name:
-                return item
-
-        for item in self.gold_list:
-            if item.name == name:
-                return item
-        return None
+        self.refresh()
+        return self.gacha_index.get(name)
 
     def list_owned(self, username):
         owned = []
@@ -7,6 +7,7 @@ import threading
 from struct import pack, unpack
 from enum import Enum
 
+from libs.enumlookup import EnumLookup
 from libs.honorbank import HonorBank
 from plugin import Plugin
 from time import sleep
@@ -237,21 +238,11 @@ class Action:
         self.role = role
 
 
-class Role(Enum):
+class Role(EnumLookup, Enum):
     server = 0
     barista = 1
     cleaner = 2
 
-    @classmethod
-    def has_name(Role, name):
-        for item in Role:
-            if name == item.name:
-                return True
-        return False
-
     @classmethod
     def get_role(Role, name):
-        for item in Role:
-            if item.name == name:
-                return item
-        return None
\ No newline at end of file
+        return Role.from_name(name)
\ No newline at end of file
@@ -1,8 +1,12 @@
 import json
 import os
+import pickle
 import random
+import threading
+from time import sleep
 
 from libs.honorbank import HonorBank
+from libs.weightedsampler import LootTable, load_weights
 from plugin import Plugin
 
 
@@ -23,19 +27,32 @@ class CafeTCG(Plugin):
         self.dir = data_dir
         self.cafetcg = {}
         self.cardlist = []
+        # Drop rates for packs and quests, tunable through loot/cafetcg.json
+        self.loot_tables = self.build_loot_tables()
 
         if not os.path.exists(self.dir):
             os.makedirs(self.dir)
 
         if self.build_cards():
-            self.pack_manager = PackManager(self.cardlist)
+            self.pack_manager = PackManager(self.cardlist, self.loot_tables["Packs"])
             self.card_storage = CardManager(self.dir, self.cardlist)
             self.card_storage.update_accounts()
             self.account_manager = HonorBank()
-            # self.quest_manager = QuestManager(self.pack_manager)
+            self.quest_manager = QuestManager(self.dir, self.pack_manager, self.loot_tables)
+
+            # Launches a deamon thread that replenishes the quest board
+            thread = threading.Thread(target = self.quest_loop)
+            thread.daemon = True
+            thread.start()
         else:
             print("Error: CafeTCG: Could not load card data!")
 
+    # Adds new quests to the board every hour to replace those that were completed
+    def quest_loop(self):
+        while threading.main_thread().is_alive():
+            sleep(3600)
+            self.quest_manager.replenish()
+
     # Builds cards by requesting json data
     def build_cards(self):
         try:
@@ -48,6 +65,20 @@ class CafeTCG(Plugin):
             print("No data could be loaded.")
             return False
 
+    # Loads and precompiles all loot tables, falling back to the default drop rates
+    def build_loot_tables(self):
+        defaults = {
+                    "Packs": {"Common": 55, "Uncommon": 30, "Rare": 13, "Ultra-Rare": 3},
+                    "QuestRewards": {"Honor": 1, "Card": 1},
+                    "QuestRarity": {"Common": 1, "Uncommon": 1, "Rare": 1, "Ultra-Rare": 1}
+                    }
+        weights = load_weights(self.dir + "/loot/cafetcg.json", defaults)
+        loot_tables = {}
+
+        for table in defaults.keys():
+            loot_tables[table] = LootTable(weights.get(table, defaults[table]))
+        return loot_tables
+
     # Parses and fills a list with card objects
     def parse_cardlist(self, card_data):
         for card in card_data:
@@ -208,7 +239,7 @@ class CafeTCG(Plugin):
     # Shows a changelog of new features and changes
     def change_log(self):
         changes = "1. Added /selldups \n" +\
-                  "2.  \n" +\
+                  "2. Quests are back! See /availablequests \n" +\
                   "3.  \n" + \
                   "4.  \n"
         return changes
@@ -289,21 +320,16 @@ class CafeTCG(Plugin):
 
     def sell_duplicates(self, command):
         if self.card_storage.account_exists(command.user.username):
-            collection = self.card_storage.get_collection_list(command.user.username)
+            sold = self.card_storage.remove_duplicates(command.user.username)
 
             total_cards = 0
             total_value = 0
 
-            for key in collection.keys():
-                if collection[key] > 1:
-                    while collection[key] > 1:
-                        collection[key] = collection[key] - 1
-                        self.card_storage.remove_card(command.user.username, key.name)
-                        value = self.get_card(key.name).value
-                        total_cards += 1
-                        total_value += value
-                        self.account_manager.pay(command.user.username, value)
+            for card in sold.keys():
+                total_cards += sold[card]
+                total_value += card.value * sold[card]
 
+            self.account_manager.pay(command.user.username, total_value)
             return "CafeTCG: You have sold {} card(s) for {} honor!".format(total_cards, total_value)
 
     def make_quest(self, command):
@@ -320,8 +346,8 @@ class CafeTCG(Plugin):
 
     def complete_quest(self, command):
         user = command.user.username
-        quest_name = command.args
-        return self.quest_manager.turn_in(user, self.card_storage, self.account_manager, quest_name)
+        quest_id = command.args
+        return self.quest_manager.turn_in(user, self.card_storage, self.account_manager, quest_id)
 
     def on_command(self, command):
         if command.command == "tcgregister":
@@ -361,14 +387,14 @@ class CafeTCG(Plugin):
                 return {"type": "message", "message": self.award_card(command)}
             elif command.command == "selldups":
                 return {"type": "message", "message": self.sell_duplicates(command)}
-            # elif command.command == "makequest":
-            #     return {"type": "message", "message": self.make_quest(command)}
-            # elif command.command == "availablequests":
-            #     return {"type": "message", "message": self.list_quests(command)}
-            # elif command.command == "readquest":
-            #     return {"type": "message", "message": self.read_quest(command)}
-            # elif command.command == "completequest":
-            #     return {"type": "message", "message": self.complete_quest(command)}
+            elif command.command == "makequest":
+                return {"type": "message", "message": self.make_quest(command)}
+            elif command.command == "availablequests":
+                return {"type": "message", "message": self.list_quests(command)}
+            elif command.command == "readquest":
+                return {"type": "message", "message": self.read_quest(command)}
+            elif command.command == "completequest":
+                return {"type": "message", "message": self.complete_quest(command)}
 
     def get_commands(self):
         return {"booster", "read", "sell", "collection", "trade",
@@ -396,8 +422,8 @@ class CafeTCG(Plugin):
                 "/selldups \n" \
                 "/makequest \n" \
                 "/availablequests \n" \
-                "/readquest [quest_name] \n" \
-                "/completequest [quest_name]\n"
+                "/readquest [quest_id] \n" \
+                "/completequest [quest_id]\n"
 
 
 """
@@ -431,7 +457,7 @@ Capable of randomly drawing cards for 'opening packs'
 
 
 class CardPack:
-    def __init__(self, card_list):
+    def __init__(self, card_list, rarity_table):
         self.card_list = card_list
         self.common_list = []
         self.uncommon_list = []
@@ -439,6 +465,16 @@ class CardPack:
         self.ultra_rare_list = []
         self.parse_rarity()
 
+        self.rarity_lists = {
+                            "Common": self.common_list,
+                            "Uncommon": self.uncommon_list,
+                            "Rare": self.rare_list,
+                            "Ultra-Rare": self.ultra_rare_list
+                            }
+        # Rarities this set has no cards for can never be drawn
+        self.rarity_table = rarity_table.restrict([rarity for rarity in self.rarity_lists.keys()
+                                                   if len(self.rarity_lists[rarity]) > 0])
+
     def parse_rarity(self):
         for common in self.card_list:
             if common.rarity == "Common":
@@ -457,22 +493,14 @@ class CardPack:
         rand = random.randint(0, len(rarity_pack) - 1)
         return rarity_pack[rand]
 
-    def open_card_pack(self):
+    def draw_rarity(self, rarity):
+        return self.draw_card(self.rarity_lists[rarity])
+
+    # Draws three cards per pack, rolling each card's rarity from the pack loot table
+    def open_card_pack(self, quantity=1):
         card_pack = []
-        for x in range(0, 3):
-            rand = random.randint(1, 101)
-            # 55% odds at common
-            if 1 <= rand <= 55:
-                card_pack.append(self.draw_card(self.common_list))
-            # 30% odds at uncommon
-            elif 56 <= rand <= 85:
-                card_pack.append(self.draw_card(self.uncommon_list))
-            # 13% odds at rare
-            elif 86 <= rand <= 98:
-                card_pack.append(self.draw_card(self.rare_list))
-            # 3%
-            else:
-                card_pack.append(self.draw_card(self.ultra_rare_list))
+        for rarity in self.rarity_table.roll_many(quantity * 3):
+            card_pack.append(self.draw_rarity(rarity))
         return card_pack
 
     def view_set_list(self):
@@ -491,8 +519,9 @@ Contains methods to open packs
 
 
 class PackManager:
-    def __init__(self, cardlist):
+    def __init__(self, cardlist, rarity_table):
         self.cardlist = cardlist
+        self.rarity_table = rarity_table
         self.cardpacks = {}
         self.parse_packs(cardlist)
 
@@ -509,16 +538,13 @@ class PackManager:
             for card in cardlist:
                 if card.card_set == card_set:
                     card_set_list.append(card)
-            self.cardpacks[card_set] = CardPack(card_set_list)
+            self.cardpacks[card_set] = CardPack(card_set_list, self.rarity_table)
 
     def open_pack(self, pack_name):
         return self.cardpacks[pack_name].open_card_pack()
     
     def open_multiple(self, pack_name, quantity):
-        opened_cards = []
-        for x in range(0, quantity):
-            opened_cards += self.cardpacks[pack_name].open_card_pack()
-        return opened_cards
+        return self.cardpacks[pack_name].open_card_pack(quantity)
 
     def pack_exists(self, pack_name):
         return self.cardpacks[pack_name]
@@ -546,16 +572,19 @@ class CardManager:
     def __init__(self, directory, card_list):
         self.dir = directory
         self.card_list = card_list
+        # Write-through cache of each user's card counts, keyed by username
+        self.collections = {}
+        self.lock = threading.RLock()
 
     def create_account(self, name):
-        with open(self.dir + "/" + name + ".json", "w+") as f:
+        with self.lock:
             data = {}
 
             for item in self.card_list:
                 data[item.name] = 0
 
-            json.dump(data, f, sort_keys=True, indent=4)
-            f.close()
+            self.collections[name] = data
+            self.save_collection(name)
 
     # Updates json data for user accounts when new card sets are added
     # IMPORTANT: IF A SET IS REMOVED ALL CARDS FROM THAT SET IN A USERS JSON DATA WILL BE REMOVED!
@@ -581,45 +610,77 @@ class CardManager:
             print("CafeTCG: Unable to open account card files!")
 
     def account_exists(self, name):
+        if name in self.collections:
+            return True
+
         directory = self.dir + "/" + name + ".json"
         return os.path.isfile(directory) and os.path.getsize(directory) > 0
 
+    # Returns a user's cached card counts, reading their json file the first time they are requested
+    def load_collection(self, name):
+        if name not in self.collections:
+            with open(self.dir + "/" + name + ".json", "r") as f:
+                self.collections[name] = json.load(f)
+                f.close()
+        return self.collections[name]
+
+    # Writes a user's cached card counts back to their json file
+    def save_collection(self, name):
+        with open(self.dir + "/" + name + ".json", "w+") as f:
+            json.dump(self.collections[name], f, sort_keys=True, indent=4)
+            f.close()
+
     def add_card(self, name, card_name):
-        with open(self.dir + "/" + name + ".json", "r+") as f:
-            data = json.load(f)
+        return self.add_cards(name, card_name, 1)
 
-            value = data[card_name]
-            value += 1
-            data[card_name] = value
+    # Adds several copies of a card in a single write
+    def add_cards(self, name, card_name, quantity):
+        with self.lock:
+            data = self.load_collection(name)
 
-            f.seek(0)
-            json.dump(data, f, sort_keys=True, indent=4)
-            f.truncate()
-            f.close()
+            if card_name not in data:
+                return False
+
+            data[card_name] += quantity
+            self.save_collection(name)
             return True
 
     def remove_card(self, name, card_name):
-        with open(self.dir + "/" + name + ".json", "r+") as f:
-            data = json.load(f)
+        return self.remove_cards(name, card_name, 1)
 
-            for card in self.card_list:
-                if card.name == card_name:
-                    value = data[card.name]
-                    if value > 0:
-                        value -= 1
-                        data[card.name] = value
-                        f.seek(0)
-                        json.dump(data, f, sort_keys=True, indent=4)
-                        f.truncate()
-                        f.close()
-                        return True
-            f.seek(0)
-            f.close()
+    # Removes several copies of a card in a single write, only if the user owns all of them
+    def remove_cards(self, name, card_name, quantity):
+        with self.lock:
+            data = self.load_collection(name)
+
+            if data.get(card_name, 0) >= quantity > 0:
+                data[card_name] -= quantity
+                self.save_collection(name)
+                return True
             return False
 
+    # Removes every copy of a card beyond the first in a single read and write
+    # Returns a dict of the card objects removed and how many copies of each were taken
+    def remove_duplicates(self, name):
+        with self.lock:
+            data = self.load_collection(name)
+
+            removed = {}
+
+            for card in self.card_list:
+                value = data[card.name]
+
+                if value > 1:
+                    removed[card] = value - 1
+                    data[card.name] = 1
+
+            if removed:
+                self.save_collection(name)
+            return removed
+
     def get_collection(self, name):
-        with open(self.dir + "/" + name + ".json", "r+") as f:
-            data = json.load(f)
+        with self.lock:
+            data = self.load_collection(name)
 
             collection = "Here is your collection: \n"
 
@@ -628,14 +689,11 @@ class CardManager:
 
                 if value > 0:
                     collection += card.name + " | " + str(value) + "\n"
-
-            f.seek(0)
-            f.close()
             return collection
 
     def get_collection_list(self, name):
-        with open(self.dir + "/" + name + ".json", "r+") as f:
-            data = json.load(f)
+        with self.lock:
+            data = self.load_collection(name)
 
             collection = {}
 
@@ -644,9 +702,6 @@ class CardManager:
 
                 if value > 0:
                     collection[card] = value
-
-            f.seek(0)
-            f.close()
             return collection
 
 
@@ -657,97 +712,66 @@ Randomly generates quest names, descriptions, and type
 
 
 class Quest:
-    def __init__(self, pack_manager, pack_list):
+    # Upper bound on how many cards of each rarity a quest deals in
+    max_quantity = {"Common": 11, "Uncommon": 9, "Rare": 4, "Ultra-Rare": 2}
+    # Range of honor a quest asks for in exchange for a card of each rarity
+    honor_cost = {"Common": (25, 151), "Uncommon": (50, 351), "Rare": (100, 601), "Ultra-Rare": (200, 1201)}
+
+    def __init__(self, quest_id, pack_manager, pack_list, loot_tables):
+        self.quest_id = quest_id
         self.cost = {}
         self.reward = {}
         self.quest_type = ""
         self.completed = False
 
-        self.create_quest(pack_manager, pack_list)
+        self.create_quest(pack_manager, pack_list, loot_tables)
 
         self.name = self.generate_name()
         self.desc = self.generate_desc()
 
-    def create_quest(self, pack_manager, pack_list):
-        rand_award = random.randint(0, 2)
+    def create_quest(self, pack_manager, pack_list, loot_tables):
+        award = loot_tables["QuestRewards"].roll()
+        pack = pack_manager.pack_exists(random.choice(pack_list))
         self.cost = {}
         self.reward = {}
 
-        if rand_award == 0:  # Looks like the reward is honor!
-            rand_honor = random.randint(50, 1500)
-            self.reward["Quantity"] = rand_honor
-        elif rand_award == 1:  # Looks like the reward is a card!
-            rand_pack = random.randint(0, len(pack_list))
-            pack = pack_list[rand_pack]
-
-            rand_rarity = random.randint(0, 4)
-
-            quantity = 0
-            card = Card
-
-            if rand_rarity == 0:
-                quantity = random.randint(1, 11)
-                pack = pack_manager.pack_exists(pack)
-                card = pack.draw_card(pack.common_list)
-            elif rand_rarity == 1:
-                quantity = random.randint(1, 9)
-                pack = pack_manager.pack_exists(pack)
-                card = pack.draw_card(pack.uncommon_list)
-            elif rand_rarity == 2:
-                quantity = random.randint(1,4)
-                pack = pack_manager.pack_exists(pack)
-                card = pack.draw_card(pack.rare_list)
-            elif rand_rarity == 3:
-                quantity = random.randint(1,2)
-                pack = pack_manager.pack_exists(pack)
-                card = pack.draw_card(pack.ultra_rare_list)
-            self.reward["Card"] = card
-            self.reward["Quantity"] = quantity
-
-        if rand_award == 0: # Quest requirement is cards
-            rand_pack = random.randint(0, len(pack_list))
-            pack = pack_list[rand_pack]
+        if award == "Honor":  # Looks like the reward is honor! Quest requirement is cards
+            honor = random.randint(50, 1500)
+            self.reward["Honor"] = honor
+            self.reward["Quantity"] = honor
             self.quest_type = "Card"
-            honor = self.reward["Quantity"]
 
             if 50 <= honor <= 300:
-                quantity = random.randint(1, 11)
-                card = pack_manager.pack_exists(pack).draw_card("Common")
+                rarity = "Common"
             elif 301 <= honor <= 600:
-                quantity = random.randint(1, 9)
-                card = pack_manager.pack_exists(pack).draw_card("Uncommon")
+                rarity = "Uncommon"
             elif 601 <= honor <= 1001:
-                quantity = random.randint(1, 4)
-                card = pack_manager.pack_exists(pack).draw_card("Rare")
+                rarity = "Rare"
             else:
-                quantity = random.randint(1, 2)
-                card = pack_manager.pack_exists(pack).draw_card("Ultra-Rare")
+                rarity = "Ultra-Rare"
 
-            self.cost["Card"] = card
-            self.cost["Quantity"] = quantity
-        elif rand_award == 1: # Quest requirement is honor
+            # Sets without cards of the matching rarity fall back to that set's own drop rates
+            if rarity not in pack.rarity_table.outcomes:
+                rarity = pack.rarity_table.roll()
+
+            self.cost["Card"] = pack.draw_rarity(rarity).name
+            self.cost["Quantity"] = random.randint(1, self.max_quantity[rarity])
+        else:  # Looks like the reward is a card! Quest requirement is honor
+            rarity = loot_tables["QuestRarity"].roll()
             self.quest_type = "Honor"
-            honor_required = 0
-            rarity = self.reward["Card"].rarity
 
-            if rarity == "Common":
-                honor_required = random.randint(25, 151)
-            elif rarity == "Uncommon":
-                honor_required = random.randint(50, 351)
-            elif rarity == "Rare":
-                honor_required = random.randint(100, 601)
-            elif rarity == "Ultra-Rare":
-                honor_required = random.randint(200, 1201)
-            self.cost["Honor"] = honor_required
+            if rarity not in pack.rarity_table.outcomes:
+                rarity = pack.rarity_table.roll()
 
+            self.reward["Card"] = pack.draw_rarity(rarity).name
+            self.reward["Quantity"] = random.randint(1, self.max_quantity[rarity])
+            self.cost["Honor"] = random.randint(self.honor_cost[rarity][0], self.honor_cost[rarity][1])
 
     def generate_name(self):
-        rand_name = random.randint(0,20)
         names = ["Robin Banks","Doge","T-Series","Steve Clarney","Michard Klawkins","King Arthur","Danny Devito","Rick Astley","Mr. X","Captain Toad","Todd Howard","SonicFox","John Cena","Ethan Bradberry","Strange Rope Hero","Rugged Randal","Stig Turner","Redd","Snake","Walter W."]
-        return names[rand_name]
+        return random.choice(names)
 
     def generate_desc(self):
-        rand_desc = random.randint(0,20)
         desc = ["Their merry band requires it for support during a raid!","Such mystery, amazing, reward, wow!","They're ahead in the subscriber war, and need it to secure the win!","They have uncovered a secret passage in a tomb, and believes it may act as a clue",
         "They have uncovered hidden lore in a tome, and believe acquiring this will lead to answers!","They found a sword in a stone and believe it may be wedged out by aquiring this supplies!",
         "Never wants to give you up, and assuredly won't if you give them these items.","They're gonna give it to ya unless you pay up!","They are looking to find new treasures and want to add this to their collection!",
@@ -755,7 +779,7 @@ class Quest:
         "They're a collector of such things, and would be happy to have it.","They require it to complete a social experiment.","They're a bit of a geek, and it will help keep them focused on fighting crime.","They want some cool artifacts to decorate up their truck.",
         "They're adrift in space and could use it as fuel!","They grow bored on their darwinistic island and wants to start a card collection.","They're starting a shady business, and believe it serves as an important ingredient",
         "They aquired a forgery at auction, and want to get a replacement.","They're addicted to cards, and aren't sure what to do."]
-        return desc[rand_desc]
+        return random.choice(desc)
 
     def lore_string(self):
         if self.quest_type == "Card":
@@ -772,76 +796,118 @@ class Quest:
 
 """
 Manages and generates Quest objects
+Persists the quest board and indexes quests by their id
 Contains methods to view information on quests and complete them
 """
 
 
 class QuestManager:
-    def __init__(self, pack_manager):
+    def __init__(self, directory, pack_manager, loot_tables, board_size=3):
+        self.dir = directory
         self.pack_manager = pack_manager
-        self.packs = []
-        for pack in self.pack_manager.cardpacks.keys():
-            self.packs.append(pack)
-        self.quests = []
-
-        for x in range(3):
-            self.make_quest()
+        self.loot_tables = loot_tables
+        self.board_size = board_size
+        self.packs = list(self.pack_manager.cardpacks.keys())
+        # Dict composed of quest ids as keys and Quest objs as values
+        self.quests = {}
+        self.next_id = 1
+        self.lock = threading.RLock()
+        self.load()
+        self.replenish()
 
     def make_quest(self):
-        self.quests.append(Quest(self.pack_manager, self.packs))
+        with self.lock:
+            quest = Quest(self.next_id, self.pack_manager, self.packs, self.loot_tables)
+            self.quests[quest.quest_id] = quest
+            self.next_id += 1
+            self.save()
         return "CafeTCG: A new quest has been created!"
 
+    # Tops the board back up to board_size quests
+    def replenish(self):
+        with self.lock:
+            while len(self.quests) < self.board_size:
+                self.make_quest()
+
     def available_quests(self):
         message = "CafeTCG: The following are available quests: \n"
-        for quest in self.quests:
-            message += quest.name + "\n"
+        for quest in list(self.quests.values()):
+            message += "{}: {}\n".format(quest.quest_id, quest.name)
         return message
 
-    def quest_exists(self, quest_name):
-        for quest in self.quests:
-            if quest.name == quest_name:
-                return True
-        return False
+    # Returns the quest with a given id, accepting the id as a string straight from a command
+    def get_quest(self, quest_id):
+        try:
+            return self.quests.get(int(quest_id))
+        except ValueError:
+            return None
+
+    def quest_exists(self, quest_id):
+        return self.get_quest(quest_id) is not None
 
-    def read_quest(self, quest_name):
-        for quest in self.quests:
-            if quest.name == quest_name:
-                return "CafeTCG:" + quest.lore_string() + "\n({})".format(quest.requirements_string())
+    def read_quest(self, quest_id):
+        quest = self.get_quest(quest_id)
+        if quest is not None:
+            return "CafeTCG:" + quest.lore_string() + "\n({})".format(quest.requirements_string())
         return "CafeTCG: Quest does not exist!"
 
-    def turn_in(self, user, card_storage, account_manager, quest_name):
+    def turn_in(self, user, card_storage, account_manager, quest_id):
         if not card_storage.account_exists(user):
             card_storage.create_account(user)
 
         if not account_manager.account_exists(user):
             account_manager.create_account(user)
 
-        for quest in self.quests:
-            if quest.name == quest_name:
-                if quest.quest_type == "Card":
-                    honor_reward = quest.reward["Honor"]
-                    requirement = quest.cost["Card"].name
-                    requirement_quantity = quest.cost["Quantity"]
-
-                    user_collection = card_storage.get_collection_list(user)
-
-                    if user_collection[requirement] >= requirement_quantity:
-                        for x in range(requirement_quantity):
-                            card_storage.remove_card(user, requirement)
-                        account_manager.pay(user, honor_reward)
-                        self.quests.remove(quest)
-                        return "CafeTCG: Quest completed! You got {} honor for {} {}!".format(honor_reward, requirement_quantity, requirement)
-                    return "CafeTCG: You do not possess enough of that card!"
-
-                else:
-                    card_reward = quest.reward["Card"].name
-                    reward_quantity = quest.reward["Quantity"]
-                    requirement = quest.cost["Honor"]
-
-                    if account_manager.charge(user, requirement):
-                        for x in range(reward_quantity):
-                            card_storage.add_card(user, card_reward)
-                        self.quests.remove(quest)
-                        return "CafeTCG: Quest completed! You got {} {} for {} honor".format(reward_quantity, card_reward, requirement)
-                    return "CafeTCG: You do not have enough honor to complete this quest!"
-        return "CafeTCG: That quest does not exist!"
\ No newline at end of file
+        # Held for the whole exchange so a quest can only ever be completed once
+        with self.lock:
+            quest = self.get_quest(quest_id)
+            if quest is None:
+                return "CafeTCG: That quest does not exist!"
+
+            if quest.quest_type == "Card":
+                honor_reward = quest.reward["Honor"]
+                requirement = quest.cost["Card"]
+                requirement_quantity = quest.cost["Quantity"]
+
+                if card_storage.remove_cards(user, requirement, requirement_quantity):
+                    account_manager.pay(user, honor_reward)
+                    del self.quests[quest.quest_id]
+                    self.save()
+                    return "CafeTCG: Quest completed! You got {} honor for {} {}!".format(honor_reward, requirement_quantity, requirement)
+                return "CafeTCG: You do not possess enough of that card!"
+            else:
+                card_reward = quest.reward["Card"]
+                reward_quantity = quest.reward["Quantity"]
+                requirement = quest.cost["Honor"]
+
+                if account_manager.charge(user, requirement):
+                    card_storage.add_cards(user, card_reward, reward_quantity)
+                    del self.quests[quest.quest_id]
+                    self.save()
+                    return "CafeTCG: Quest completed! You got {} {} for {} honor".format(reward_quantity, card_reward, requirement)
+                return "CafeTCG: You do not have enough honor to complete this quest!"
+
+    # Saves the quest board
+    def save(self):
+        with self.lock:
+            with open(self.dir + "/quests.file", "wb") as f:
+                pickle.dump({"next_id": self.next_id, "quests": self.quests}, f)
+                f.close()
+
+    # Loads the quest board, dropping quests for cards that are no longer in any set
+    def load(self):
+        try:
+            if os.path.getsize(self.dir + "/quests.file") > 0:
+                with open(self.dir + "/quests.file", "rb") as f:
+                    board = pickle.load(f)
+                    f.close()
+
+                self.next_id = board["next_id"]
+                card_names = set(card.name for card in self.pack_manager.cardlist)
+
+                for quest in board["quests"].values():
+                    if quest.cost.get("Card", quest.reward.get("Card")) in card_names:
+                        self.quests[quest.quest_id] = quest
+            print("CafeTCG: Quest file successfully loaded!")
+        except FileNotFoundError:
+            print("CafeTCG: No quest file exists, creating a new one.")
@@ -1,9 +1,12 @@
+import heapq
 import json
 import os
 import pickle
 import random
+import sqlite3
 import threading
-from time import sleep
+from datetime import datetime
+from time import perf_counter, sleep, time
 
 from libs.honorbank import HonorBank
 from plugin import Plugin
@@ -24,11 +27,12 @@ class HostileTakeover(Plugin):
     def __init__(self, data_dir, bot):
         self.data_dir = data_dir
         self.bot = bot
-        self.companies = []
-
         self.account_manager = HonorBank()
-        self.load_companies()
         self.event_management = EventManagement(data_dir)
+        self.company_store = CompanyStore(data_dir + "/data/companies.db")
+        self.companies = CompanyRegistry(self.company_store)
+        self.load_companies()
+        self.market = ShareMarket(self.company_store, self.account_manager)
 
         thread = threading.Thread(target = self.generate_conditions)  # runs for 43200 seconds
         thread.daemon = True
@@ -47,8 +51,8 @@ class HostileTakeover(Plugin):
             if self.get_company(commands[0].lower()) is None and not commands[0] == "":
                 if self.account_manager.charge(command.user.username, startup_cost):
                     new_company = Company(commands[0].lower(), command.user.username)
-                    self.companies.append(new_company)
-                    self.save_companies()
+                    self.companies.add(new_company)
+                    self.save_company(new_company)
                     return "CafeHT: Successfully created new company {}".format(commands[0])
                 return "CafeHT: Unable to create new company. You need {} honor to make a company!".format(startup_cost)
             return "CafeHT: Unable to create new company. A company with this name already exists!"
@@ -76,17 +80,31 @@ class HostileTakeover(Plugin):
         """
 
         response = "CafeHT: The following companies are available:\n"
-        for company in self.companies:
+        for company in self.companies.values():
             response += company.name + "\n"
         return response
 
+    def my_companies(self, command):
+        """
+        Creates a response listing every company the user currently owns
+        :param command: inputs taken from the user
+        :return: a string listing out the user's companies
+        """
+
+        owned = self.companies.owned_by(command.user.username)
+        if len(owned) > 0:
+            response = "CafeHT: You own the following companies:\n"
+            for company in owned:
+                response += "{} (tier {})\n".format(company.name, company.tier)
+            return response
+        return "CafeHT: You do not own any companies."
+
     def claim_profits(self, command):
         """
         Pays out all profits to the users invested in a specific company.
         Only the owner of a company may pay out profits.
         Profits are paid out to the owner, and all investors.
         Algorithm is profits * share% * market_mod
-        This will be made more efficient at a later time
         """
 
         commands = command.args.split(" ")
@@ -96,18 +114,7 @@ class HostileTakeover(Plugin):
                 if company.owner == command.user.username:
                     if not company.paid_today:
                         profits = company.profits
-                        market_mod = 1.0
-                        policies = company.policies
-
-                        for condition in self.event_management.current_conditions:
-                            for policy in policies:
-                                if policy.modifiers.__contains__(condition.name):
-                                    market_mod += policy.mod_mc
-                                else:
-                                    market_mod += policy.default_mc
-
-                        if market_mod < 0:
-                            market_mod = 0.0
+                        market_mod = self.event_management.market_modifier(company)
 
                         response = "CafeHT: The following amounts have been paid out for {}:\n".format(company.name)
                         for share_owner in company.shares.keys():
@@ -118,7 +125,7 @@ class HostileTakeover(Plugin):
 
                         company.profits = 0
                         company.paid_today = True
-                        self.save_companies()
+                        self.save_company(company)
                         return response
                     return "CafeHT: This company has already paid out today."
                 return "CafeHT: Only the company owner can issue this command."
@@ -142,7 +149,7 @@ class HostileTakeover(Plugin):
 
                     if self.account_manager.charge(command.user.username, int(commands[1])):
                         company.update_tier()
-                        self.save_companies()
+                        self.company_store.save(company, snapshot=True)
                         return "CafeHT: Invested {} into {} company!".format(int(commands[1]), company.name)
                     return "CafeHT: You do not possess {} honor to invest!".format(int(commands[1]))
                 except ValueError:
@@ -161,22 +168,35 @@ class HostileTakeover(Plugin):
         if len(commands) == 3:
             company = self.get_company(commands[0].lower())
             if company is not None:
+                buyer = command.user.username
+                seller = commands[1]
                 try:
-                    if company.tier >= 4:
-                        cost = (company.value / 100) * int(commands[2])
-                        if self.account_manager.get_funds(command.user.username) >= cost:
-                            if company.transfer_shares(command.user.username, commands[1], int(commands[2])):
-                                if self.account_manager.charge(command.user.username, cost):
-                                    self.account_manager.pay(commands[1], int(cost * 0.9))
-                                    self.save_companies()
-                                    return "CafeHT: Transferred shares from {} to {}".format(commands[1],
-                                                                                             command.user.username)
-                                return "CafeHT: Unable to transfer shares. Buyer does not have {} honor.".format(cost)
-                            return "CafeHT: Unable to transfer shares. They do not possess that amount!"
-                        return "CafeHT: Unable to transfer shares. You cannot afford {} honor!".format(cost)
-                    return "CafeHT: Unable to transfer shares. This company is not yet public at tier 4."
+                    amount = int(commands[2])
                 except ValueError:
                     return "CafeHT: Invalid command format! Please enter /buyshares [company] [person] [amount]"
+
+                if amount <= 0:
+                    return "CafeHT: Unable to transfer shares. You must buy at least one share."
+                if buyer == seller:
+                    return "CafeHT: Unable to transfer shares. You cannot buy shares from yourself."
+                if company.tier < 4:
+                    return "CafeHT: Unable to transfer shares. This company is not yet public at tier 4."
+                if not self.account_manager.account_exists(buyer):
+                    return "CafeHT: Unable to transfer shares. You do not have an honor account."
+                if not self.account_manager.account_exists(seller):
+                    return "CafeHT: Unable to transfer shares. {} does not have an honor account.".format(seller)
+
+                cost = int(company.value / 100 * amount)
+                if self.market.available_shares(company, seller) >= amount:
+                    owner = company.owner
+                    if self.account_manager.charge(buyer, cost):
+                        company.transfer_share(buyer, seller, amount)
+                        self.companies.update_owner(company, owner)
+                        self.account_manager.pay(seller, int(cost * 0.9))
+                        self.save_company(company)
+                        return "CafeHT: Transferred shares from {} to {}".format(seller, buyer)
+                    return "CafeHT: Unable to transfer shares. You cannot afford {} honor!".format(cost)
+                return "CafeHT: Unable to transfer shares. They do not possess that amount!"
             return "CafeHT: The company {} does not exist!".format(commands[0])
         return "CafeHT: Invalid command format! Please enter /buyshares [company] [person] [amount]"
 
@@ -197,6 +217,136 @@ class HostileTakeover(Plugin):
             return "CafeHT: The company {} does not exist!".format(commands[0])
         return "CafeHT: Invalid command format! Please enter /checkshares [company_name]"
 
+    def place_order(self, command, side):
+        """
+        Places a limit order to buy (bid) or sell (ask) shares of a company.
+        The order is matched against the company's order book and whatever isn't filled stays open.
+        :param command: inputs taken from the user
+        :param side: "bid" or "ask"
+        :return: a string detailing the results of the command
+        """
+
+        commands = command.args.split(" ")
+        if len(commands) == 3:
+            company = self.get_company(commands[0].lower())
+            if company is not None:
+                try:
+                    price = int(commands[1])
+                    amount = int(commands[2])
+                except ValueError:
+                    return "CafeHT: Invalid command format! Please enter /{} [company] [price] [amount]".format(side)
+
+                if price <= 0 or not 0 < amount <= 100:
+                    return "CafeHT: Orders need a positive price and between 1 and 100 shares."
+                if company.tier < 4:
+                    return "CafeHT: Unable to place order. This company is not yet public at tier 4."
+                if not self.account_manager.account_exists(command.user.username):
+                    return "CafeHT: Unable to place order. You do not have an honor account."
+
+                owner = company.owner
+                result = self.market.place(company, command.user.username, side, price, amount)
+                if result is None:
+                    if side == "bid":
+                        return "CafeHT: Unable to place bid. You do not possess {} honor!".format(price * amount)
+                    return "CafeHT: Unable to place ask. You do not have {} shares that aren't already for " \
+                           "sale!".format(amount)
+                self.companies.update_owner(company, owner)
+
+                order, fills = result
+                response = "CafeHT: Placed {} #{} for {} shares of {} at {} honor each.\n".format(
+                    side, order.order_id, amount, company.name, price)
+                for buyer, seller, fill_price, fill_amount in fills:
+                    response += "{} bought {} shares from {} at {} honor each.\n".format(buyer, fill_amount, seller,
+                                                                                       fill_price)
+                if order.amount > 0:
+                    response += "{} shares remain open on the order book.".format(order.amount)
+                return response
+            return "CafeHT: The company {} does not exist!".format(commands[0])
+        return "CafeHT: Invalid command format! Please enter /{} [company] [price] [amount]".format(side)
+
+    def cancel_order(self, command):
+        """
+        Cancels one of the user's open orders, returning its escrowed honor or shares
+        :param command: input providing the order id
+        :return: a string detailing the results of the command
+        """
+
+        try:
+            order_id = int(command.args.strip().lstrip("#"))
+        except ValueError:
+            return "CafeHT: Invalid command format! Please enter /cancelorder [order_id]"
+
+        if self.market.cancel(command.user.username, order_id):
+            return "CafeHT: Cancelled order #{}.".format(order_id)
+        return "CafeHT: You do not have an open order #{}.".format(order_id)
+
+    def my_orders(self, command):
+        """
+        Lists every open order placed by the user
+        :param command: inputs taken from the user
+        :return: a string listing out the user's open orders
+        """
+
+        orders = self.market.orders_of(command.user.username)
+        if len(orders) > 0:
+            response = "CafeHT: You have the following open orders:\n"
+            for order in orders:
+                response += "#{} {} {} shares of {} at {} honor each\n".format(order.order_id, order.side,
+                                                                               order.amount, order.company,
+                                                                               order.price)
+            return response
+        return "CafeHT: You do not have any open orders."
+
+    def order_book(self, command):
+        """
+        Shows the best open bids and asks for a company, grouped by price
+        :param command: input providing the company name
+        :return: a string describing the company's order book
+        """
+
+        commands = command.args.split(" ")
+        if len(commands) == 1:
+            company = self.get_company(commands[0].lower())
+            if company is not None:
+                asks, bids = self.market.depth(company.name, 5)
+                response = "CafeHT: Order book for {}:\nAsks:\n".format(company.name)
+                for price, amount in reversed(asks):
+                    response += "{} shares at {}\n".format(amount, price)
+                response += "Bids:\n"
+                for price, amount in bids:
+                    response += "{} shares at {}\n".format(amount, price)
+                return response
+            return "CafeHT: The company {} does not exist!".format(commands[0])
+        return "CafeHT: Invalid command format! Please enter /orderbook [company_name]"
+
+    def company_history(self, command):
+        """
+        Shows how a company's value, tier and profits changed over the last few days
+        :param command: input providing the company name and optionally the amount of days
+        :return: a string describing the company's history
+        """
+
+        commands = command.args.split(" ")
+        if 1 <= len(commands) <= 2:
+            company = self.get_company(commands[0].lower())
+            if company is not None:
+                try:
+                    days = int(commands[1]) if len(commands) == 2 else 7
+                except ValueError:
+                    return "CafeHT: Invalid command format! Please enter /comphistory [company_name] [days]"
+
+                end = int(time())
+                rows = self.company_store.history(company.name, end - max(1, days) * 86400, end, 10)
+                if len(rows) > 0:
+                    response = "CafeHT: History of {} over the last {} days:\n".format(company.name, max(1, days))
+                    for timestamp, value, tier, profits in rows:
+                        response += "{}: value {}, tier {}, profits {}\n".format(
+                            datetime.fromtimestamp(timestamp).strftime("%m/%d %H:%M"), int(value), tier, int(profits))
+                    return response
+                return "CafeHT: No history has been recorded for {} yet.".format(company.name)
+            return "CafeHT: The company {} does not exist!".format(commands[0])
+        return "CafeHT: Invalid command format! Please enter /comphistory [company_name] [days]"
+
     def market_conditions(self):
         """
         Obtains a description of the current market conditions
@@ -217,13 +367,13 @@ class HostileTakeover(Plugin):
             company = self.get_company(commands[0].lower())
             if company is not None:
                 if command.user.username == company.owner:
-                    for policy in self.event_management.policies_list:
-                        if policy.name == commands[1].lower():
-                            if company.add_policy(policy):
-                                self.save_companies()
-                                return "CafeHT: Successfully added {} policy to this company!".format(commands[1])
-                            return "CafeHT: Unable to add policy. It may already be set in this company or policy " \
-                                   "limit is full "
+                    policy = self.event_management.get_policy(commands[1].lower())
+                    if policy is not None:
+                        if company.add_policy(policy):
+                            self.save_company(company)
+                            return "CafeHT: Successfully added {} policy to this company!".format(commands[1])
+                        return "CafeHT: Unable to add policy. It may already be set in this company or policy " \
+                               "limit is full "
                     return "CafeHT: Unable to add policy. {} is not a policy.".format(commands[1])
                 return "CafeHT: Unable to add policy. You are not the owner of this company."
             return "CafeHT: The company {} does not exist!".format(commands[0])
@@ -243,7 +393,7 @@ class HostileTakeover(Plugin):
             if company is not None:
                 if command.user.username == company.owner:
                     if company.remove_policy(commands[1]):
-                        self.save_companies()
+                        self.save_company(company)
                         return "CafeHT: Successfully removed {} policy from this company!".format(commands[1])
                     return "CafeHT: Unable to remove policy. It does not exist within this company!"
                 return "CafeHT: Unable to remove policy. You are not the owner of this company."
@@ -317,66 +467,81 @@ class HostileTakeover(Plugin):
         :return: the company object if it is found or None otherwise
         """
 
-        for company in self.companies:
-            if company.name == name:
-                return company
-        return None
+        return self.companies.get(name)
 
-    def save_companies(self):
+    def save_company(self, company):
         """
-        Saves all companies contained within self.companies into a file
+        Saves a single company's row in the company database
+        :param company: the company to be saved
         """
 
-        with open(self.data_dir + "/data/" + "companies" + ".file", "wb") as f:
-            pickle.dump(self.companies, f)
-            f.seek(0)
-            f.close()
+        self.company_store.save(company)
 
     def load_companies(self):
         """
-        Loads a list of all companies contained within a file into self.companies
+        Loads all companies from the company database into self.companies.
+        Companies saved in the older pickled companies.file are moved into the database the first time it is empty.
+        """
+
+        companies = self.company_store.load(self.event_management.policies)
+        if len(companies) == 0:
+            companies = self.load_legacy_companies()
+            self.company_store.save_all(companies)
+
+        for company in companies:
+            self.companies.add(company)
+
+    def load_legacy_companies(self):
+        """
+        Loads companies from the pickled companies.file used before the company database
+        Older files hold a list of companies rather than a dict keyed by name
+        :return: a list of the companies found
         """
 
         try:
             if os.path.getsize(self.data_dir + "/data/companies.file") > 0:
                 with open(self.data_dir + "/data/companies.file", "rb") as f:
-                    self.companies = pickle.load(f)
-                    if not isinstance(self.companies, list):  # I'm horrible... I used isinstance...
-                        list(self.companies)
+                    companies = pickle.load(f)
                     f.seek(0)
                     f.close()
-        except FileNotFoundError:
-            if not os.path.exists(self.data_dir + "/data"):
-                os.makedirs(self.data_dir + "/data")
 
-            # Ensures that the account file is created.
-            with open(self.data_dir + "/data/companies.file", "w+") as f:
-                f.write("")
-                f.seek(0)
-                f.close()
+                if isinstance(companies, dict):
+                    companies = companies.values()
+                return list(companies)
+        except FileNotFoundError:
+            pass
+        return []
 
     def generate_conditions(self):
         """
         Runs every 12 hours.
         Generates new market conditions and resets company payout.
+        Profits are settled for every company with a single database update,
+        loaded companies apply the cycle the next time they are looked up or saved.
+        Every company's settled state is then added to the company history.
         """
 
         while threading.main_thread().is_alive():
+            start = perf_counter()
+            self.event_management.refresh()
             self.event_management.set_conditions()
-            for company in self.companies:
-                company.paid_today = False
-                company.profits += company.value
-            self.save_companies()
+            self.company_store.start_cycle([condition.name for condition in self.event_management.current_conditions])
+            print("CafeHT: Market cycle for {} companies took {:.1f}ms".format(len(self.companies),
+                                                                              (perf_counter() - start) * 1000))
             sleep(43200)
 
     # TODO: Change this to one command input 'ht' with multiple sub commands as params
     def on_command(self, command):
+        self.event_management.refresh()
+
         if command.command == "createcomp":
             return {"type": "message", "message": self.create_company(command)}
         elif command.command == "compowner":
             return {"type": "message", "message": self.check_owner(command)}
         elif command.command == "listcomp":
             return {"type": "message", "message": self.list_companies()}
+        elif command.command == "mycomps":
+            return {"type": "message", "message": self.my_companies(command)}
         elif command.command == "claim":
             return {"type": "message", "message": self.claim_profits(command)}
         elif command.command == "invest":
@@ -385,6 +550,18 @@ class HostileTakeover(Plugin):
             return {"type": "message", "message": self.buy_shares(command)}
         elif command.command == "checkshares":
             return {"type": "message", "message": self.check_share(command)}
+        elif command.command == "bid":
+            return {"type": "message", "message": self.place_order(command, "bid")}
+        elif command.command == "ask":
+            return {"type": "message", "message": self.place_order(command, "ask")}
+        elif command.command == "cancelorder":
+            return {"type": "message", "message": self.cancel_order(command)}
+        elif command.command == "myorders":
+            return {"type": "message", "message": self.my_orders(command)}
+        elif command.command == "orderbook":
+            return {"type": "message", "message": self.order_book(command)}
+        elif command.command == "comphistory":
+            return {"type": "message", "message": self.company_history(command)}
         elif command.command == "mc":
             return {"type": "message", "message": self.market_conditions()}
         elif command.command == "addpol":
@@ -401,19 +578,535 @@ class HostileTakeover(Plugin):
             return {"type": "message", "message": self.get_value(command)}
 
     def get_commands(self):
-        return {"createcomp", "compowner", "listcomp", "claim", "invest", "buyshares", "checkshares",
-                "mc", "addpol", "rmpol", "listpol", "allpol", "comptier", "compvalue"}
+        return {"createcomp", "compowner", "listcomp", "mycomps", "claim", "invest", "buyshares", "checkshares",
+                "bid", "ask", "cancelorder", "myorders", "orderbook", "comphistory", "mc", "addpol", "rmpol",
+                "listpol", "allpol", "comptier", "compvalue"}
 
     def get_name(self):
         return "Hostile Takeover"
 
     def get_help(self):
-        return "/createcomp [company_name] \n /compowner [company_name] \n /listcomp \n /claim [company_name] \n " \
+        return "/createcomp [company_name] \n /compowner [company_name] \n /listcomp \n /mycomps \n /claim [company_name] \n " \
                "/invest [company_name] [amount] \n /buyshares [company] [person] [amount] \n /checkshares" \
-               "[company_name] \n /mc \n /addpol [company_name] [policy_name] \n /rmpol [company_name] [policy_name]" \
+               "[company_name] \n /bid [company] [price] [amount] \n /ask [company] [price] [amount] \n " \
+               "/cancelorder [order_id] \n /myorders \n /orderbook [company_name] \n " \
+               "/comphistory [company_name] [days] \n /mc \n " \
+               "/addpol [company_name] [policy_name] \n /rmpol [company_name] [policy_name]" \
                "\n /listpol [company_name] \n /allpol \n /comptier [company_name] \n /compvalue [company_name] \n "
 
 
+class CompanyRegistry:
+    def __init__(self, store):
+        """
+        :param store: the CompanyStore holding these companies, whose market cycle they are settled up to
+        """
+
+        self.store = store
+        # Dict composed of company names as keys and Company objs as values
+        self.companies = {}
+        # Dict composed of users as keys and a dict of the companies they own (by name) as values
+        self.owners = {}
+
+    def add(self, company):
+        """
+        Adds a company to the registry and indexes it under its owner
+        :param company: company to be added
+        """
+
+        company.cycle = self.store.cycle
+        self.companies[company.name] = company
+        self.owners.setdefault(company.owner, {})[company.name] = company
+
+    def get(self, name):
+        """
+        :param name: the name of the company
+        :return: the company object if it is found or None otherwise
+        """
+
+        company = self.companies.get(name)
+        if company is not None:
+            company.settle_cycles(self.store.cycle)
+        return company
+
+    def owned_by(self, owner):
+        """
+        :param owner: name of a user
+        :return: a list of the companies owned by that user
+        """
+
+        return list(self.owners.get(owner, {}).values())
+
+    def update_owner(self, company, previous_owner):
+        """
+        Moves a company to its new owner's index after its shares change hands
+        :param company: company whose shares were transferred
+        :param previous_owner: owner of the company before the transfer
+        """
+
+        if company.owner != previous_owner:
+            owned = self.owners.get(previous_owner, {})
+            owned.pop(company.name, None)
+            if len(owned) == 0:
+                self.owners.pop(previous_owner, None)
+            self.owners.setdefault(company.owner, {})[company.name] = company
+
+    def values(self):
+        return self.companies.values()
+
+    def __len__(self):
+        return len(self.companies)
+
+
+class CompanyStore:
+    def __init__(self, path):
+        """
+        Stores one row per company in SQLite so single companies can be saved, and a whole
+        market cycle applied, without rewriting every company
+        :param path: location of the database file
+        """
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.lock = threading.Lock()
+        # Number of market cycles applied to the stored companies since they were loaded, only changed under self.lock
+        self.cycle = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS companies (name TEXT PRIMARY KEY, owner TEXT, "
+                                    "tier INTEGER, value INTEGER, profits REAL, paid_today INTEGER, "
+                                    "shares TEXT, policies TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS orders (id INTEGER PRIMARY KEY, company TEXT, "
+                                    "user TEXT, side TEXT, price INTEGER, amount INTEGER)")
+            self.create_history()
+            self.connection.execute("CREATE TABLE IF NOT EXISTS conditions_history (time INTEGER PRIMARY KEY, "
+                                    "conditions TEXT)")
+
+    def create_history(self):
+        """
+        Creates the history table, moving snapshots out of the older table keyed by (company, time) alone.
+        Only called while holding self.lock, inside a transaction.
+        """
+
+        columns = [column[1] for column in self.connection.execute("PRAGMA table_info(history)")]
+        if len(columns) > 0 and "seq" not in columns:
+            self.connection.execute("ALTER TABLE history RENAME TO history_old")
+
+        # Append only history, clustered by company and time so a range query only reads the rows it returns.
+        # seq numbers the snapshots a company takes within the same second, so no snapshot ever replaces another.
+        # Values are stored as integers, which SQLite packs into as few bytes as each one needs.
+        self.connection.execute("CREATE TABLE IF NOT EXISTS history (company TEXT, time INTEGER, seq INTEGER, "
+                                "value INTEGER, tier INTEGER, profits INTEGER, PRIMARY KEY (company, time, seq)) "
+                                "WITHOUT ROWID")
+
+        if len(columns) > 0 and "seq" not in columns:
+            self.connection.execute("INSERT INTO history SELECT company, time, 0, value, tier, profits FROM history_old")
+            self.connection.execute("DROP TABLE history_old")
+
+    def row(self, company):
+        """
+        Settles the company up to the stored market cycle before its row is written, so a company looked up
+        before a cycle started never overwrites the profits that cycle added. Only called while holding self.lock.
+        :param company: the company to be saved
+        :return: the company's row in the companies table
+        """
+
+        company.settle_cycles(self.cycle)
+        return (company.name, company.owner, company.tier, company.value, company.profits, int(company.paid_today),
+                json.dumps(company.shares), json.dumps([policy.name for policy in company.policies]))
+
+    def save(self, company, snapshot=False):
+        """
+        Inserts or replaces a single company's row
+        :param company: the company to be saved
+        :param snapshot: also adds the company's current state to its history
+        """
+
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    self.row(company))
+            if snapshot:
+                now = int(time())
+                self.connection.execute("INSERT INTO history SELECT ?, ?, COUNT(*), ?, ?, ? FROM history "
+                                        "WHERE company = ? AND time = ?",
+                                        (company.name, now, company.value, company.tier, int(company.profits),
+                                         company.name, now))
+
+    def save_all(self, companies):
+        """
+        Saves many companies in one transaction
+        :param companies: the companies to be saved
+        """
+
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        [self.row(company) for company in companies])
+
+    def load(self, policies):
+        """
+        Loads every company
+        :param policies: dict of policy names to Policy objects used to restore each company's policies
+        :return: a list of Company objects
+        """
+
+        companies = []
+        with self.lock:
+            rows = self.connection.execute("SELECT name, owner, tier, value, profits, paid_today, shares, policies "
+                                           "FROM companies").fetchall()
+
+        for name, owner, tier, value, profits, paid_today, shares, policy_names in rows:
+            company = Company(name, owner)
+            company.tier = tier
+            company.value = value
+            company.profits = profits
+            company.paid_today = bool(paid_today)
+            company.shares = json.loads(shares)
+            company.policies = [policies[policy] for policy in json.loads(policy_names) if policy in policies]
+            companies.append(company)
+        return companies
+
+    def start_cycle(self, conditions):
+        """
+        Applies a market cycle to every stored company and records the result in the history, in a single transaction.
+        Loaded companies settle the new cycle in O(1) the next time they are looked up or saved.
+        :param conditions: names of the market conditions drawn for this cycle
+        """
+
+        now = int(time())
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE companies SET profits = profits + value, paid_today = 0")
+            self.connection.execute("INSERT INTO history SELECT name, ?, (SELECT COUNT(*) FROM history WHERE "
+                                    "company = companies.name AND time = ?), value, tier, CAST(profits AS INTEGER) "
+                                    "FROM companies", (now, now))
+            self.connection.execute("INSERT OR REPLACE INTO conditions_history VALUES (?, ?)",
+                                    (now, json.dumps(conditions)))
+            self.cycle += 1
+
+    def history(self, company_name, start, end, points):
+        """
+        Downsamples a company's history between two times into evenly sized buckets.
+        The averaging happens inside SQLite, so only the returned buckets are ever loaded.
+        :param company_name: the company to look up
+        :param start: unix time the range starts at
+        :param end: unix time the range ends at
+        :param points: the most buckets to return
+        :return: a list of (last time, average value, highest tier, average profits) per bucket holding any snapshots
+        """
+
+        bucket = max(1, (end - start) // points + 1)
+        with self.lock:
+            return self.connection.execute("SELECT MAX(time), AVG(value), MAX(tier), AVG(profits) FROM history "
+                                           "WHERE company = ? AND time BETWEEN ? AND ? GROUP BY (time - ?) / ? "
+                                           "ORDER BY MAX(time)", (company_name, start, end, start, bucket)).fetchall()
+
+    def save_orders(self, orders, company=None):
+        """
+        Saves changed orders, and the company they traded, in one transaction so a trade is never half written.
+        Orders with nothing left to fill are deleted.
+        :param orders: the orders to be saved
+        :param company: the company whose shares changed hands, if any
+        """
+
+        with self.lock, self.connection:
+            if company is not None:
+                self.connection.execute("INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        self.row(company))
+            for order in orders:
+                if order.amount > 0:
+                    self.connection.execute("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?)",
+                                            (order.order_id, order.company, order.user, order.side, order.price,
+                                             order.amount))
+                else:
+                    self.connection.execute("DELETE FROM orders WHERE id = ?", (order.order_id,))
+
+    def load_orders(self):
+        """
+        :return: a list of every open Order, oldest first
+        """
+
+        with self.lock:
+            rows = self.connection.execute("SELECT id, company, user, side, price, amount FROM orders "
+                                           "ORDER BY id").fetchall()
+        return [Order(*row) for row in rows]
+
+
+class ShareMarket:
+    def __init__(self, store, bank, fee=0.1):
+        """
+        Limit order markets for company shares, matched by price and then time.
+        Orders escrow what they trade when placed (honor for bids, shares for asks),
+        so a match can always settle and never needs to charge anyone.
+        :param store: CompanyStore used to persist open orders and traded companies
+        :param bank: HonorBank that escrows and pays out honor
+        :param fee: cut of every sale kept by the market, matching /buyshares
+        """
+
+        self.store = store
+        self.bank = bank
+        self.fee = fee
+        # Dict composed of company names as keys and their OrderBook as values
+        self.books = {}
+        # Dict composed of order ids as keys and every open Order as values
+        self.orders = {}
+        # Dict composed of (company name, user) as keys and the amount of shares held by their open asks as values
+        self.reserved = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+        for order in self.store.load_orders():
+            self.rest(order)
+            if order.side == "ask":
+                self.reserve(order.company, order.user, order.amount)
+            self.next_id = order.order_id + 1
+
+    def book(self, company_name):
+        if company_name not in self.books:
+            self.books[company_name] = OrderBook()
+        return self.books[company_name]
+
+    def available_shares(self, company, user):
+        """
+        :param company: the company to check
+        :param user: name of a share owner
+        :return: the user's shares in the company that aren't held by an open ask
+        """
+
+        return company.shares.get(user, 0) - self.reserved.get((company.name, user), 0)
+
+    def reserve(self, company_name, user, amount):
+        key = (company_name, user)
+        self.reserved[key] = self.reserved.get(key, 0) + amount
+        if self.reserved[key] <= 0:
+            del self.reserved[key]
+
+    def rest(self, order):
+        self.orders[order.order_id] = order
+        self.book(order.company).add(order)
+
+    def release(self, order, payouts):
+        """
+        Closes an open order and returns whatever it still escrows
+        :param order: the order to close
+        :param payouts: dict of users to honor owed to them, any refund is added to it
+        """
+
+        if order.side == "bid":
+            payouts[order.user] = payouts.get(order.user, 0) + order.price * order.amount
+        else:
+            self.reserve(order.company, order.user, -order.amount)
+        self.orders.pop(order.order_id, None)
+        self.book(order.company).discard(order)
+
+    def place(self, company, user, side, price, amount):
+        """
+        Escrows a new order, matches it against the other side of the company's book and leaves anything unfilled open.
+        The company and every touched order are saved in one transaction, then each user is paid once.
+        :param company: the company whose shares are traded
+        :param user: name of the user placing the order
+        :param side: "bid" to buy or "ask" to sell
+        :param price: the most honor per share a bid pays, or the least an ask accepts
+        :param amount: the amount of shares to trade
+        :return: (order, fills) where fills lists (buyer, seller, price, amount) per match, or None if the user
+        has no honor account or can't cover the order
+        """
+
+        with self.lock:
+            # Every trade pays both sides, so only users with an honor account may trade
+            if not self.bank.account_exists(user):
+                return None
+            if side == "bid":
+                if not self.bank.charge(user, price * amount):
+                    return None
+            elif self.available_shares(company, user) >= amount:
+                self.reserve(company.name, user, amount)
+            else:
+                return None
+
+            order = Order(self.next_id, company.name, user, side, price, amount)
+            self.next_id += 1
+
+            payouts = {}
+            changed = {}
+            fills = self.match(company, order, payouts, changed)
+            if order.amount > 0:
+                self.rest(order)
+                changed[order.order_id] = order
+
+            self.store.save_orders(changed.values(), company if len(fills) > 0 else None)
+            for payee in payouts.keys():
+                self.bank.pay(payee, payouts[payee])
+            return order, fills
+
+    def match(self, company, order, payouts, changed):
+        """
+        Fills an incoming order against the best resting orders for as long as their prices cross.
+        Trades happen at the resting order's price, bids that paid more into escrow are refunded the difference.
+        :param company: the company whose shares are traded
+        :param order: the incoming order
+        :param payouts: dict of users to honor owed to them, filled in by this method
+        :param changed: dict of order ids to resting orders touched by this method
+        :return: a list of (buyer, seller, price, amount) for every match
+        """
+
+        book = self.book(company.name)
+        opposite = "ask" if order.side == "bid" else "bid"
+        fills = []
+
+        while order.amount > 0:
+            resting = book.best(opposite)
+            if resting is None:
+                break
+            if (order.side == "bid" and resting.price > order.price) or \
+                    (order.side == "ask" and resting.price < order.price):
+                break
+
+            changed[resting.order_id] = resting
+            buyer, seller = (order, resting) if order.side == "bid" else (resting, order)
+
+            # Users never trade with themselves, and asks whose shares were sold through /buyshares can't fill,
+            # either way the resting order is cancelled instead
+            if resting.user == order.user or company.shares.get(seller.user, 0) < min(order.amount, resting.amount):
+                self.release(resting, payouts)
+                continue
+
+            amount = min(order.amount, resting.amount)
+            company.transfer_share(buyer.user, seller.user, amount)
+            self.reserve(company.name, seller.user, -amount)
+
+            sale = resting.price * amount
+            payouts[seller.user] = payouts.get(seller.user, 0) + int(sale * (1 - self.fee))
+            if buyer.price > resting.price:
+                payouts[buyer.user] = payouts.get(buyer.user, 0) + (buyer.price - resting.price) * amount
+
+            order.amount -= amount
+            resting.amount -= amount
+            if resting.amount == 0:
+                self.orders.pop(resting.order_id, None)
+                book.discard(resting)
+            fills.append((buyer.user, seller.user, resting.price, amount))
+
+        return fills
+
+    def cancel(self, user, order_id):
+        """
+        Cancels an open order and refunds its escrow
+        :param user: name of the user cancelling, only an order's owner may cancel it
+        :param order_id: id of the order
+        :return: True if the order was cancelled
+        """
+
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None or order.user != user:
+                return False
+
+            payouts = {}
+            self.release(order, payouts)
+            self.store.save_orders([order])
+            for payee in payouts.keys():
+                self.bank.pay(payee, payouts[payee])
+            return True
+
+    def orders_of(self, user):
+        """
+        :param user: name of a user
+        :return: a list of the user's open orders, oldest first
+        """
+
+        with self.lock:
+            return sorted([order for order in self.orders.values() if order.user == user],
+                          key=lambda order: order.order_id)
+
+    def depth(self, company_name, levels):
+        """
+        :param company_name: the company to check
+        :param levels: the most price levels to list per side
+        :return: (asks, bids), each a list of (price, total shares) from the best price outwards
+        """
+
+        with self.lock:
+            book = self.books.get(company_name)
+            if book is None:
+                return [], []
+            return book.depth("ask", levels), book.depth("bid", levels)
+
+
+class OrderBook:
+    def __init__(self):
+        # Heaps of (-price, order id, Order) and (price, order id, Order), so the best price and then the oldest
+        # order is always on top
+        self.bids = []
+        self.asks = []
+        # Number of orders in either heap that are still open, closed orders are dropped lazily
+        self.open = 0
+
+    def add(self, order):
+        if order.side == "bid":
+            heapq.heappush(self.bids, (-order.price, order.order_id, order))
+        else:
+            heapq.heappush(self.asks, (order.price, order.order_id, order))
+        self.open += 1
+
+    def best(self, side):
+        """
+        :param side: "bid" or "ask"
+        :return: the open order with the best price on that side, oldest first among equal prices, or None
+        """
+
+        heap = self.bids if side == "bid" else self.asks
+        while len(heap) > 0 and heap[0][2].amount <= 0:
+            heapq.heappop(heap)
+        if len(heap) > 0:
+            return heap[0][2]
+        return None
+
+    def discard(self, order):
+        """
+        Marks an order as closed. It stays in its heap until it reaches the top or the heaps are compacted.
+        :param order: the order to close
+        """
+
+        order.amount = 0
+        self.open -= 1
+        if len(self.bids) + len(self.asks) > 2 * self.open + 64:
+            self.bids = [entry for entry in self.bids if entry[2].amount > 0]
+            self.asks = [entry for entry in self.asks if entry[2].amount > 0]
+            heapq.heapify(self.bids)
+            heapq.heapify(self.asks)
+
+    def depth(self, side, levels):
+        """
+        :param side: "bid" or "ask"
+        :param levels: the most price levels to list
+        :return: a list of (price, total shares) from the best price outwards
+        """
+
+        totals = []
+        for key, order_id, order in sorted(self.bids if side == "bid" else self.asks):
+            if order.amount <= 0:
+                continue
+            if len(totals) > 0 and totals[-1][0] == order.price:
+                totals[-1] = (order.price, totals[-1][1] + order.amount)
+            elif len(totals) < levels:
+                totals.append((order.price, order.amount))
+            else:
+                break
+        return totals
+
+
+class Order:
+    def __init__(self, order_id, company, user, side, price, amount):
+        self.order_id = order_id
+        self.company = company
+        self.user = user
+        # "bid" to buy shares or "ask" to sell them
+        self.side = side
+        # Honor per share
+        self.price = price
+        # Shares left to fill
+        self.amount = amount
+
+
 class Company:
     def __init__(self, name, owner):
         self.name = name
@@ -424,6 +1117,41 @@ class Company:
         self.paid_today = False
         self.shares = {owner: 100}
         self.policies = []
+        # Market cycle this company's profits are settled up to, set by CompanyRegistry
+        self.cycle = 0
+        # (conditions version, market modifier) computed by EventManagement.market_modifier
+        self.market_mod_cache = None
+
+    def __getstate__(self):
+        """
+        Leaves the market modifier cache out of saved companies since it only holds for the current conditions
+        """
+
+        state = dict(self.__dict__)
+        state.pop("market_mod_cache", None)
+        state.pop("cycle", None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores the fields left out by __getstate__, which companies pickled before they existed never had either
+        """
+
+        self.__dict__.update(state)
+        self.cycle = 0
+        self.market_mod_cache = None
+
+    def settle_cycles(self, cycle):
+        """
+        Applies every market cycle this company has missed: profits grow by its value and it may pay out again
+        :param cycle: the current market cycle
+        """
+
+        pending = cycle - self.cycle
+        if pending > 0:
+            self.profits += self.value * pending
+            self.paid_today = False
+            self.cycle = cycle
 
     def add_policy(self, policy):
         """
@@ -435,6 +1163,7 @@ class Company:
         if len(self.policies) < 3:
             if not self.policies.__contains__(policy):
                 self.policies.append(policy)
+                self.market_mod_cache = None
                 return True
             return False
         return False
@@ -449,6 +1178,7 @@ class Company:
         for policy in self.policies:
             if policy.name == policy_name:
                 self.policies.remove(policy)
+                self.market_mod_cache = None
                 return True
         return False
 
@@ -464,7 +1194,7 @@ class Company:
         if self.shares.keys().__contains__(seller):
             if self.shares[seller] >= amount:
                 self.shares[seller] = self.shares[seller] - amount
-                self.shares[buyer] = self.shares[buyer] + amount
+                self.shares[buyer] = self.shares.get(buyer, 0) + amount
                 self.update_owner()
                 return True
             return False
@@ -523,7 +1253,7 @@ class Policy:
         self.description = description
         self.default_mc = default_market
         self.mod_mc = modded_market
-        self.modifiers = modifiers
+        self.modifiers = frozenset(modifiers)
 
 
 class MarketCondition:
@@ -534,12 +1264,25 @@ class MarketCondition:
 
 class EventManagement:
     def __init__(self, data_dir):
+        self.data_dir = data_dir
+        # Dict composed of policy names as keys and Policy objs as values
+        self.policies = {}
         self.policies_list = []
+        # Dict composed of condition names as keys and MarketCondition objs as values
+        self.conditions = {}
         self.conditions_list = []
+        # Dict composed of condition names as keys and a list of the policies that condition modifies as values
+        self.condition_policies = {}
+        # Dict composed of catalog names as keys and the mtime of their json file when last loaded as values
+        self.catalog_mtimes = {}
         self.current_conditions = []
+        # Dict composed of policy names as keys and their market modifier under the current conditions as values
+        self.policy_contributions = {}
+        # Incremented whenever conditions change so cached company modifiers can tell they are stale
+        self.conditions_version = 0
+        self.lock = threading.RLock()
 
-        self.parse_policies(self.initialize_json(data_dir, "policies"))
-        self.parse_conditions(self.initialize_json(data_dir, "conditions"))
+        self.refresh()
         self.set_conditions()
 
     @staticmethod
@@ -568,41 +1311,172 @@ class EventManagement:
                 f.seek(0)
                 f.close()
 
+    def catalog_mtime(self, filename):
+        try:
+            return os.stat(self.data_dir + "/data/" + filename + ".json").st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        """
+        Reloads the policy and condition catalogs if either json file has changed since they were last loaded.
+        Only two stat calls are made when nothing has changed.
+        :return: True if the catalogs were reloaded
+        """
+
+        mtimes = {"policies": self.catalog_mtime("policies"), "conditions": self.catalog_mtime("conditions")}
+        if mtimes == self.catalog_mtimes:
+            return False
+
+        with self.lock:
+            try:
+                policies = self.parse_policies(self.initialize_json(self.data_dir, "policies"))
+                conditions = self.parse_conditions(self.initialize_json(self.data_dir, "conditions"))
+            except (TypeError, KeyError, IndexError, ValueError):
+                print("CafeHT: Unable to parse the policy and condition catalogs, keeping the current ones.")
+                self.catalog_mtimes = mtimes
+                return False
+
+            self.catalog_mtimes = {"policies": self.catalog_mtime("policies"),
+                                   "conditions": self.catalog_mtime("conditions")}
+            self.compile_catalogs(policies, conditions)
+            print("CafeHT: Loaded {} policies and {} market conditions.".format(len(self.policies),
+                                                                               len(self.conditions)))
+            return True
+
     def parse_policies(self, data):
         """
         Parses policies from json data into a list of Policy objects
         :param data: json data to be parsed
+        :return: a list of Policy objects
         """
-        policies = data["Policies"]
-        for policy in policies:
+
+        parsed = []
+        for policy in data["Policies"]:
             modifiers = [policy["Mods"][0]["Mod1"].lower(), policy["Mods"][0]["Mod2"].lower(),
                          policy["Mods"][0]["Mod3"].lower()]
-            self.policies_list.append(Policy(policy["Name"].lower(), policy["Description"], policy["Default"],
-                                             policy["Modded"], modifiers))
+            parsed.append(Policy(policy["Name"].lower(), policy["Description"], policy["Default"],
+                                 policy["Modded"], modifiers))
+        return parsed
 
     def parse_conditions(self, data):
         """
         Parses market conditions from json data into a list of MarketCondition objects
         :param data: json data to be parsed
+        :return: a list of MarketCondition objects
+        """
+
+        return [MarketCondition(condition["Name"].lower(), condition["Description"]) for condition in
+                data["Conditions"]]
+
+    def compile_catalogs(self, policies, conditions):
+        """
+        Indexes freshly parsed catalogs by name and builds the condition -> affected policies index.
+        Policies that already exist are updated in place so companies holding them see the changes.
+        :param policies: a list of Policy objects
+        :param conditions: a list of MarketCondition objects
         """
 
-        conditions = data["Conditions"]
-        for condition in conditions:
-            self.conditions_list.append(MarketCondition(condition["Name"].lower(), condition["Description"]))
+        compiled_policies = {}
+        for policy in policies:
+            existing = self.policies.get(policy.name)
+            if existing is not None:
+                existing.__dict__.update(policy.__dict__)
+                policy = existing
+            compiled_policies[policy.name] = policy
+
+        condition_policies = {}
+        for policy in compiled_policies.values():
+            for modifier in policy.modifiers:
+                condition_policies.setdefault(modifier, []).append(policy)
+
+        self.policies = compiled_policies
+        self.policies_list = list(compiled_policies.values())
+        self.conditions = {condition.name: condition for condition in conditions}
+        self.conditions_list = list(self.conditions.values())
+        self.condition_policies = condition_policies
+
+        # Keep the drawn conditions but pick up any changed descriptions
+        self.current_conditions = [self.conditions.get(condition.name, condition) for condition in
+                                   self.current_conditions]
+        self.update_contributions()
+
+    def get_policy(self, name):
+        """
+        :param name: name of a policy
+        :return: the Policy with that name, or None if there isn't one
+        """
+
+        return self.policies.get(name)
 
     def set_conditions(self):
         """
         Sets the current market conditions (picks three conditions from self.conditions_list without replacement)
         """
-        mutable_conditions = list(self.conditions_list)
-        drawn_conditions = []
 
-        if len(mutable_conditions) >= 3:
-            for x in range(0, 3):
-                r = random.randint(0, len(mutable_conditions) - 1)
-                drawn_conditions.append(mutable_conditions[r])
+        with self.lock:
+            if len(self.conditions_list) >= 3:
+                self.current_conditions = random.sample(self.conditions_list, 3)
+            else:
+                self.current_conditions = []
+            self.update_contributions()
+
+    def update_contributions(self):
+        """
+        Rebuilds every policy's contribution to the market modifier for the current conditions.
+        Policies start at their default contribution and only the policies a drawn condition modifies are adjusted.
+        """
+
+        contributions = {}
+        for policy in self.policies_list:
+            contributions[policy.name] = policy.default_mc * len(self.current_conditions)
+
+        for condition in self.current_conditions:
+            for policy in self.condition_policies.get(condition.name, ()):
+                contributions[policy.name] += policy.mod_mc - policy.default_mc
+
+        self.policy_contributions = contributions
+        self.conditions_version += 1
+
+    def policy_contribution(self, policy):
+        """
+        Sums how much a policy moves the market modifier under the current conditions
+        :param policy: the policy to evaluate
+        :return: the policy's total contribution to the market modifier
+        """
+
+        contribution = 0.0
+        for condition in self.current_conditions:
+            if condition.name in policy.modifiers:
+                contribution += policy.mod_mc
+            else:
+                contribution += policy.default_mc
+        return contribution
+
+    def market_modifier(self, company):
+        """
+        Finds a company's market modifier, 1.0 plus the contribution of each of its policies (never below 0).
+        The result is cached on the company until its policies or the market conditions change.
+        :param company: the company to evaluate
+        :return: the company's market modifier
+        """
+
+        cache = getattr(company, "market_mod_cache", None)
+        if cache is not None and cache[0] == self.conditions_version:
+            return cache[1]
+
+        market_mod = 1.0
+        for policy in company.policies:
+            contribution = self.policy_contributions.get(policy.name)
+            if contribution is None:
+                contribution = self.policy_contribution(policy)
+            market_mod += contribution
+
+        if market_mod < 0:
+            market_mod = 0.0
 
-        self.current_conditions = drawn_conditions
+        company.market_mod_cache = (self.conditions_version, market_mod)
+        return market_mod
 
     def condition_descriptions(self):
         """
@@ -1,3 +1,9 @@
+import asyncio
+import json
+import os
+import threading
+from time import monotonic
+
 from mcstatus import MinecraftServer
 
 from plugin import Plugin
@@ -18,28 +24,91 @@ class MinecraftStatus(Plugin):
     def __init__(self, data_dir, bot):
         self.data_dir = data_dir
         self.bot = bot
-        self.is_setup = False
-        self.server = None
+        self.registry = ChatServers(data_dir + "/mcservers.json")
+        self.poller = StatusPoller(on_update=self.send_alerts)
+
+        for host in self.registry.hosts():
+            self.poller.add(host)
 
     def setup(self, command):
         commands = command.args.split(" ")
         host = commands[0]
-        self.server = MinecraftServer.lookup(host)
-        self.is_setup = True
-        return "MCStatus: Now pinging {} globally. Use /mcstatus /mcping /mcplayers to receive more information on this server.".format(host)
+        if host == "":
+            return "MCStatus: Please enter /mcsetup [ip]"
+
+        self.poller.add(host)
+        previous = self.registry.set_server(command.chat.id, host)
+        if previous is not None and previous != host and len(self.registry.chats_of(previous)) == 0:
+            self.poller.remove(previous)
+        return "MCStatus: Now pinging {} for this chat. Use /mcstatus /mcping /mcplayers to receive more information on this server.".format(host)
+
+    def set_alerts(self, command):
+        """
+        Turns player join and leave alerts on or off for the current chat
+        :param command: input of on or off
+        :return: a string detailing the results of the command
+        """
+
+        if command.args.strip().lower() in ("on", "off"):
+            enabled = command.args.strip().lower() == "on"
+            self.registry.set_alerts(command.chat.id, enabled)
+            if enabled:
+                return "MCStatus: This chat will be told whenever a player joins or leaves the server."
+            return "MCStatus: Disabled player alerts for this chat."
+        return "MCStatus: Please enter /mcalerts [on/off]"
+
+    @staticmethod
+    def player_changes(previous, status):
+        """
+        Compares the player samples of two polls of a server.
+        Servers only sample some of their players when busy, names are only compared when both samples
+        list everyone online, otherwise only the change in player count is reported.
+        :param previous: status from the earlier poll
+        :param status: status from the latest poll
+        :return: a string describing who joined and left, or None if nothing changed
+        """
+
+        old_sample = previous.players.sample or []
+        new_sample = status.players.sample or []
 
-    def get_status(self):
-        status = self.server.status()
+        if len(old_sample) == previous.players.online and len(new_sample) == status.players.online:
+            old_names = set(player.name for player in old_sample)
+            new_names = set(player.name for player in new_sample)
+            changes = ["{} joined".format(name) for name in sorted(new_names - old_names)] + \
+                      ["{} left".format(name) for name in sorted(old_names - new_names)]
+            if len(changes) > 0:
+                return ", ".join(changes)
+        elif status.players.online > previous.players.online:
+            return "{} players joined".format(status.players.online - previous.players.online)
+        elif status.players.online < previous.players.online:
+            return "{} players left".format(previous.players.online - status.players.online)
+        return None
+
+    def send_alerts(self, host, previous, status):
+        """
+        Called by the poller after every successful poll, alerts the chats that want them about player changes
+        """
+
+        if previous is None:
+            return
+
+        changes = self.player_changes(previous, status)
+        if changes is not None:
+            message = "MCStatus: {} on {}. There are now {} players connected.".format(changes, host,
+                                                                                    status.players.online)
+            for chat in self.registry.alert_chats_of(host):
+                self.bot.send_message(chat, message)
+
+    def get_status(self, status):
         return "MCStatus: There are currently {} players connected.".format(status.players.online)
 
-    def get_ping(self):
-        return "MCStatus: The server responded in {}ms".format(self.server.ping())
+    def get_ping(self, status):
+        return "MCStatus: The server responded in {}ms".format(status.latency)
 
-    def get_players(self):
-        status = self.server.status()
+    def get_players(self, status):
         response = "MCStatus: The following players are connected:\n"
 
-        for player in status.players.sample:
+        for player in status.players.sample or []:
             response += player.name + "\n"
         return response
 
@@ -47,17 +116,26 @@ class MinecraftStatus(Plugin):
         if command.command == "mcsetup":
             return {"type": "message", "message": self.setup(command)}
 
-        if not self.is_setup:
+        host = self.registry.server_of(command.chat.id)
+        if host is None:
             return {"type": "message", "message": "MCStatus: Please first run /mcsetup [ip] to configure a server."}
-        elif command.command == "mcstatus":
-            return {"type": "message", "message": self.get_status()}
+        elif command.command == "mcalerts":
+            return {"type": "message", "message": self.set_alerts(command)}
+
+        try:
+            status = self.poller.status(host)
+        except Exception as e:
+            return {"type": "message", "message": "MCStatus: Unable to reach {} ({}).".format(host, e)}
+
+        if command.command == "mcstatus":
+            return {"type": "message", "message": self.get_status(status)}
         elif command.command == "mcping":
-            return {"type": "message", "message": self.get_ping()}
+            return {"type": "message", "message": self.get_ping(status)}
         elif command.command == "mcplayers":
-            return {"type": "message", "message": self.get_players()}
+            return {"type": "message", "message": self.get_players(status)}
 
     def get_commands(self):
-        return {"mcsetup", "mcstatus", "mcping", "mcplayers"}
+        return {"mcsetup", "mcstatus", "mcping", "mcplayers", "mcalerts"}
 
     def get_name(self):
         return "Minecraft Status"
@@ -66,7 +144,8 @@ class MinecraftStatus(Plugin):
         return "'/mcstatus' to see how many players are currently connected\n \
                 '/mcping' to see the server's ping\n \
                 '/mcplayers' to see player names connected\n \
-                '/mcsetup [ip]' to configure which server to obtain information on."
+                '/mcsetup [ip]' to configure which server this chat obtains information on\n \
+                '/mcalerts [on/off]' to be told when players join or leave this chat's server."
     
     def on_message(self, message):
         # Implement this if has_message_access returns True
@@ -81,4 +160,216 @@ class MinecraftStatus(Plugin):
         pass
 
     def disable(self):
-        pass
\ No newline at end of file
+        pass
+
+
+class ChatServers:
+    def __init__(self, path):
+        """
+        Records which server each chat has configured and which chats want player alerts, saved to disk
+        :param path: location of the json file registrations are saved to
+        """
+
+        self.dir = path
+        # Dict composed of chats as keys and the host they configured as values
+        self.servers = {}
+        # Dict composed of hosts as keys and a set of the chats that configured them as values
+        self.chats = {}
+        # Set of chats that receive player join and leave alerts
+        self.alerts = set()
+        self.lock = threading.Lock()
+        self.load()
+
+    def set_server(self, chat, host):
+        """
+        :return: the host the chat had configured before, or None
+        """
+
+        with self.lock:
+            previous = self.servers.get(chat)
+            if previous is not None:
+                self.chats[previous].discard(chat)
+                if len(self.chats[previous]) == 0:
+                    del self.chats[previous]
+
+            self.servers[chat] = host
+            self.chats.setdefault(host, set()).add(chat)
+            self.save()
+            return previous
+
+    def set_alerts(self, chat, enabled):
+        with self.lock:
+            if enabled:
+                self.alerts.add(chat)
+            else:
+                self.alerts.discard(chat)
+            self.save()
+
+    def server_of(self, chat):
+        return self.servers.get(chat)
+
+    def chats_of(self, host):
+        with self.lock:
+            return set(self.chats.get(host, ()))
+
+    def alert_chats_of(self, host):
+        with self.lock:
+            return self.chats.get(host, set()) & self.alerts
+
+    def hosts(self):
+        with self.lock:
+            return list(self.chats.keys())
+
+    def save(self):
+        # Saved as lists so numeric chat ids stay numbers
+        data = {"servers": [[chat, host] for chat, host in self.servers.items()], "alerts": list(self.alerts)}
+        with open(self.dir, "w+") as f:
+            json.dump(data, f, indent=4)
+            f.close()
+
+    def load(self):
+        try:
+            with open(self.dir, "r") as f:
+                data = json.load(f)
+                f.close()
+        except FileNotFoundError:
+            print("MCStatus: No server registrations exist, creating a new file.")
+            if not os.path.exists(os.path.dirname(self.dir)):
+                os.makedirs(os.path.dirname(self.dir))
+            self.save()
+            return
+        except ValueError:
+            print("MCStatus: Unable to read {}, starting without server registrations.".format(self.dir))
+            return
+
+        for chat, host in data.get("servers", []):
+            self.servers[chat] = host
+            self.chats.setdefault(host, set()).add(chat)
+        self.alerts = set(data.get("alerts", []))
+
+
+class StatusPoller:
+    def __init__(self, interval=30, max_age=60, timeout=10, on_update=None):
+        """
+        Keeps one status snapshot per server, shared by every chat that configured it.
+        Every server is queried concurrently from one asyncio loop running in a background thread,
+        so commands never wait on a query unless the snapshot they need is stale.
+        :param interval: seconds between background refreshes of every server
+        :param max_age: oldest snapshot, in seconds, a command will be answered from before it refreshes it itself
+        :param timeout: seconds a query may take
+        :param on_update: called with (host, previous status or None, status) after each successful query
+        """
+
+        self.interval = interval
+        self.max_age = max_age
+        self.timeout = timeout
+        self.on_update = on_update
+        # Dict composed of hosts as keys and their MinecraftServer as values, None until the host is first looked up
+        self.servers = {}
+        # Dict composed of hosts as keys and (time taken, status) of their latest successful query as values
+        self.snapshots = {}
+        # Dict composed of hosts as keys and the Task of the query running for them as values, only used by the loop
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target = self.loop.run_forever)
+        thread.daemon = True
+        thread.start()
+        asyncio.run_coroutine_threadsafe(self.poll(), self.loop)
+
+    def add(self, host):
+        """
+        Starts polling a server, looking it up and fetching its first snapshot in the background
+        :param host: address of the server, optionally with :port
+        """
+
+        with self.lock:
+            if host in self.servers:
+                return
+            self.servers[host] = None
+        asyncio.run_coroutine_threadsafe(self.try_refresh(host), self.loop)
+
+    def remove(self, host):
+        with self.lock:
+            self.servers.pop(host, None)
+            self.snapshots.pop(host, None)
+
+    async def poll(self):
+        while threading.main_thread().is_alive():
+            with self.lock:
+                hosts = list(self.servers.keys())
+
+            await asyncio.gather(*[self.try_refresh(host) for host in hosts])
+            await asyncio.sleep(self.interval)
+
+    async def try_refresh(self, host):
+        try:
+            await self.refresh_async(host)
+        except Exception as e:
+            print("MCStatus: Unable to reach {} ({})".format(host, e))
+
+    async def refresh_async(self, host):
+        """
+        Queries a server for a new snapshot. Anyone asking for the same server while a query is running
+        waits on that query rather than starting their own.
+        :param host: address of the server
+        :return: the server's status
+        """
+
+        task = self.in_flight.get(host)
+        if task is None:
+            task = self.loop.create_task(self.query(host))
+            self.in_flight[host] = task
+            task.add_done_callback(lambda done: self.in_flight.pop(host, None))
+        return await asyncio.shield(task)
+
+    async def lookup(self, host):
+        """
+        Resolves a server's address, including its SRV record, without blocking the loop.
+        Failed lookups are tried again on the next query.
+        :param host: address of the server
+        :return: the server's MinecraftServer
+        """
+
+        server = await asyncio.wait_for(self.loop.run_in_executor(None, MinecraftServer.lookup, host), self.timeout)
+        with self.lock:
+            if host in self.servers:
+                self.servers[host] = server
+        return server
+
+    async def query(self, host):
+        with self.lock:
+            server = self.servers[host]
+
+        if server is None:
+            server = await self.lookup(host)
+
+        if hasattr(server, "async_status"):
+            status = await asyncio.wait_for(server.async_status(), self.timeout)
+        else:
+            status = await asyncio.wait_for(self.loop.run_in_executor(None, server.status), self.timeout)
+
+        with self.lock:
+            if host not in self.servers:
+                return status
+            previous = self.snapshots.get(host)
+            self.snapshots[host] = (monotonic(), status)
+
+        if self.on_update is not None:
+            # Alerts send messages, which must not hold up the loop
+            self.loop.run_in_executor(None, self.on_update, host, previous[1] if previous else None, status)
+        return status
+
+    def status(self, host):
+        """
+        :param host: address of the server
+        :return: the server's latest snapshot if it is at most max_age seconds old, otherwise a fresh status
+        """
+
+        with self.lock:
+            snapshot = self.snapshots.get(host)
+
+        if snapshot is not None and monotonic() - snapshot[0] <= self.max_age:
+            return snapshot[1]
+        return asyncio.run_coroutine_threadsafe(self.refresh_async(host), self.loop).result(self.timeout + 1)
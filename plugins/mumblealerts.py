@@ -1,4 +1,7 @@
-import datetime
+import asyncio
+import itertools
+import json
+import os
 import socket
 import threading
 from struct import pack, unpack
@@ -21,8 +24,11 @@ class BotPlugin(Plugin):
     def __init__(self, data_dir, bot):
         self.data_dir = data_dir
         self.bot = bot
-        self.channels = []
-        self.current_users = self.connected_users()
+        self.registry = ServerRegistry(data_dir + "/mumble_servers.json")
+        self.poller = MumblePoller()
+        # Dict composed of (host, port) as keys and their connected users at the last poll as values.
+        # A server's first poll only fills this in and never sends alerts.
+        self.current_users = {}
 
         thread = threading.Thread(target = self.return_status)
         thread.daemon = True
@@ -34,89 +40,110 @@ class BotPlugin(Plugin):
             Ping the server and display results.
         """
 
-        try:
-            addrinfo = socket.getaddrinfo(host, port, 0, 0, socket.SOL_UDP)
-        except socket.gaierror as e:
-            print(e)
-            return
-
-        for (family, socktype, proto, canonname, sockaddr) in addrinfo:
-            s = socket.socket(family, socktype, proto=proto)
-            s.settimeout(2)
+        return self.poller.poll([(host, port)])[(host, port)]
 
-            buf = pack(">iQ", 0, datetime.datetime.now().microsecond)
-            try:
-                s.sendto(buf, sockaddr)
-            except (socket.gaierror, socket.timeout) as e:
-                continue
-
-            try:
-                data, addr = s.recvfrom(1024)
-            except socket.timeout:
-                continue
+    @staticmethod
+    def parse_server(text):
+        """
+        :param text: a host, optionally followed by :port
+        :return: a (host, port) tuple, defaulting to localhost and the standard Mumble port
+        """
 
-            r = unpack(">bbbbQiii", data)
+        host, separator, port = text.strip().lower().rpartition(":")
+        if separator == "" or not port.isdigit():
+            host, port = text.strip().lower(), 64738
+        return host or "localhost", int(port)
 
-            # version = r[1:4]
-            # https://wiki.mumble.info/wiki/Protocol
-            # r[0,1,2,3] = version
-            # r[4] = ts (indent value)
-            # r[5] = users
-            # r[6] = max users
-            # r[7] = bandwidth
+    @staticmethod
+    def describe_change(server, previous, updated):
+        """
+        Describes how many users joined or left a server since the last poll in one line
+        """
 
-            return r[5]
+        name = "{}:{}".format(server[0], server[1]) if server[1] != 64738 else server[0]
+        if updated > previous:
+            change = "A user has joined" if updated - previous == 1 else "{} users have joined".format(
+                updated - previous)
+        else:
+            change = "A user has left" if previous - updated == 1 else "{} users have left".format(
+                previous - updated)
+        return "{} the mumble server {}. There are now {} connected.".format(change, name, updated)
 
     def return_status(self):
+        """
+        Polls every server some chat subscribes to every 15 seconds.
+        Each chat receives at most one message per poll covering every server it watches that changed,
+        however many users joined or left in between.
+        """
+
         while threading.main_thread().is_alive():
-            updated_users = self.connected_users()
-
-            if updated_users != self.current_users:
-                if len(self.channels) > 0:
-                    message = ""
-
-                    if self.current_users < updated_users:
-                        message = "A user has joined the mumble server. There are now " + str(updated_users) + " connected."
-                        self.current_users = updated_users
-                    elif self.current_users > updated_users:
-                        message = "A user has left the mumble server. There are now " + str(updated_users) + " connected."
-                        self.current_users = updated_users
-
-                    for channel in self.channels:
-                        self.bot.send_message(channel, message)
-                else:
-                    self.current_users = updated_users
+            servers = self.registry.all_servers()
+            results = self.poller.poll(servers) if len(servers) > 0 else {}
+
+            messages = {}
+            for server, updated_users in results.items():
+                previous = self.current_users.get(server)
+                if updated_users is None:
+                    continue
+                self.current_users[server] = updated_users
+
+                if previous is not None and previous != updated_users:
+                    line = self.describe_change(server, previous, updated_users)
+                    for channel in self.registry.subscribers_of(server):
+                        messages.setdefault(channel, []).append(line)
+
+            # Forget servers nobody watches anymore so resubscribing starts from a fresh baseline
+            for server in list(self.current_users.keys()):
+                if server not in results:
+                    del self.current_users[server]
+
+            for channel, lines in messages.items():
+                self.bot.send_message(channel, "\n".join(lines))
             sleep(15)
 
+    def subscribe(self, channel, args):
+        server = self.parse_server(args)
+        if self.registry.subscribe(channel, server):
+            return {"type": "message", "message": "Enabled mumble alerts for {} in this channel.".format(server[0])}
+        return {"type": "message", "message": "This channel is already authorized for mumble alerts from "
+                                              "{}.".format(server[0])}
+
+    def unsubscribe(self, channel, args):
+        if args.strip() == "":
+            if self.registry.unsubscribe_all(channel):
+                return {"type": "message", "message": "Disabled all mumble alerts for this channel."}
+            return {"type": "message", "message": "Alerts have not been enabled for this channel."}
+
+        server = self.parse_server(args)
+        if self.registry.unsubscribe(channel, server):
+            return {"type": "message", "message": "Disabled mumble alerts for {} in this channel.".format(server[0])}
+        return {"type": "message", "message": "Alerts have not been enabled for {} in this channel.".format(
+            server[0])}
+
     def com_enable(self, command):
-        for channel in self.channels:
-            if channel == command.chat.id:
-                return {"type": "message", "message": "This channel is already authorized for mumble alerts."}
-        self.channels.append(command.chat.id)
-        return {"type": "message", "message": "Enabled mumble alerts for this channel."}
+        return self.subscribe(command.chat.id, command.args)
 
     def com_disable(self, command):
-        for channel in self.channels:
-            if channel == command.chat.id:
-                self.channels.remove(command.chat.id)
-                return {"type": "message", "message": "Disabled mumble alerts for this channel."}
-        return {"type": "message", "message": "Alerts have not been enabled for this channel."}
+        return self.unsubscribe(command.chat.id, command.args)
 
     def com_add(self, command):
-        channel = command.args
-        
-        if channel in self.channels:
-            return {"type": "message", "message": "This channel is already authorized for mumble alerts."}
-        self.channels.append(channel)
-        return {"type": "message", "message": "Enabled mumble alerts for this channel."}
+        commands = command.args.split(" ", 1)
+        return self.subscribe(commands[0], commands[1] if len(commands) > 1 else "")
 
     def com_rm(self, command):
-        channel = command.args
+        commands = command.args.split(" ", 1)
+        return self.unsubscribe(commands[0], commands[1] if len(commands) > 1 else "")
+
+    def com_list(self, command):
+        servers = self.registry.servers_of(command.chat.id)
+        if len(servers) == 0:
+            return {"type": "message", "message": "Alerts have not been enabled for this channel."}
 
-        if channel in self.channels:
-            self.channels.remove(channel)
-            return {"type": "message", "message": "Disabled mumble alerts for this channel."}
-        return {"type": "message", "message": "Alerts have not been enabled for this channel."}
+        response = "This channel receives mumble alerts for:\n"
+        for server in sorted(servers):
+            users = self.current_users.get(server)
+            response += "{}:{} ({} connected)\n".format(server[0], server[1], "?" if users is None else users)
+        return {"type": "message", "message": response}
 
     def on_command(self, command):
         if command.command == "menable":
@@ -127,19 +154,22 @@ class BotPlugin(Plugin):
             return self.com_add(command)
         elif command.command == "mrm":
             return self.com_rm(command)
+        elif command.command == "mlist":
+            return self.com_list(command)
 
     def get_commands(self):
-        return {"menable", "mdisable", "madd", "mrm"}
+        return {"menable", "mdisable", "madd", "mrm", "mlist"}
 
     def get_name(self):
         return "Mumble Alerts"
 
     def get_help(self):
         return "Mumble Alerts Help Doc\n" \
-               "'menable' to enable alerts in the current channel\n" \
-               "'mdisable' to disable alerts in the current channel\n" \
-               "'madd [channel]' to enable alerts in a specified channel\n" \
-               "'mrm [channel]' to disable alerts in a specified channel\n"
+               "'menable [host:port]' to enable alerts for a server in the current channel (default localhost)\n" \
+               "'mdisable [host:port]' to disable alerts for a server, or every server, in the current channel\n" \
+               "'madd [channel] [host:port]' to enable alerts for a server in a specified channel\n" \
+               "'mrm [channel] [host:port]' to disable alerts for a server, or every server, in a specified channel\n" \
+               "'mlist' to list the servers the current channel receives alerts for\n"
 
     def on_message(self, message):
         # Implement this if has_message_access returns True
@@ -154,4 +184,247 @@ class BotPlugin(Plugin):
         pass
 
     def disable(self):
-        pass
\ No newline at end of file
+        pass
+
+
+class ServerRegistry:
+    def __init__(self, path):
+        """
+        Records which chats receive alerts for which Mumble servers, indexed in both directions
+        :param path: location of the json file subscriptions are saved to
+        """
+
+        self.dir = path
+        # Dict composed of (host, port) as keys and a set of subscribed chats as values
+        self.subscribers = {}
+        # Dict composed of chats as keys and a set of the (host, port) they subscribe to as values
+        self.servers = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def subscribe(self, channel, server):
+        """
+        :return: True if the chat wasn't already subscribed to the server
+        """
+
+        with self.lock:
+            if server in self.servers.get(channel, ()):
+                return False
+            self.servers.setdefault(channel, set()).add(server)
+            self.subscribers.setdefault(server, set()).add(channel)
+            self.save()
+            return True
+
+    def unsubscribe(self, channel, server):
+        """
+        :return: True if the chat was subscribed to the server
+        """
+
+        with self.lock:
+            if server not in self.servers.get(channel, ()):
+                return False
+            self.remove(channel, server)
+            self.save()
+            return True
+
+    def unsubscribe_all(self, channel):
+        """
+        :return: True if the chat was subscribed to any server
+        """
+
+        with self.lock:
+            servers = list(self.servers.get(channel, ()))
+            for server in servers:
+                self.remove(channel, server)
+            self.save()
+            return len(servers) > 0
+
+    def remove(self, channel, server):
+        self.servers[channel].discard(server)
+        if len(self.servers[channel]) == 0:
+            del self.servers[channel]
+
+        self.subscribers[server].discard(channel)
+        if len(self.subscribers[server]) == 0:
+            del self.subscribers[server]
+
+    def subscribers_of(self, server):
+        with self.lock:
+            return set(self.subscribers.get(server, ()))
+
+    def servers_of(self, channel):
+        with self.lock:
+            return set(self.servers.get(channel, ()))
+
+    def all_servers(self):
+        with self.lock:
+            return list(self.subscribers.keys())
+
+    def save(self):
+        # Saved as [chat, host, port] rows so numeric chat ids stay numbers
+        rows = [[channel, server[0], server[1]] for channel, servers in self.servers.items() for server in servers]
+        with open(self.dir, "w+") as f:
+            json.dump(rows, f, indent=4)
+            f.close()
+
+    def load(self):
+        try:
+            with open(self.dir, "r") as f:
+                rows = json.load(f)
+                f.close()
+        except FileNotFoundError:
+            print("Mumble Alerts: No subscriptions file exists, creating a new one.")
+            if not os.path.exists(os.path.dirname(self.dir)):
+                os.makedirs(os.path.dirname(self.dir))
+            self.save()
+            return
+        except ValueError:
+            print("Mumble Alerts: Unable to read {}, starting without subscriptions.".format(self.dir))
+            return
+
+        for channel, host, port in rows:
+            self.servers.setdefault(channel, set()).add((host, port))
+            self.subscribers.setdefault((host, port), set()).add(channel)
+
+
+class MumblePingProtocol(asyncio.DatagramProtocol):
+    def __init__(self, poller):
+        self.poller = poller
+
+    def datagram_received(self, data, addr):
+        if len(data) < 24:
+            return
+
+        r = unpack(">bbbbQiii", data[:24])
+
+        # version = r[1:4]
+        # https://wiki.mumble.info/wiki/Protocol
+        # r[0,1,2,3] = version
+        # r[4] = ts (indent value)
+        # r[5] = users
+        # r[6] = max users
+        # r[7] = bandwidth
+
+        future = self.poller.waiting.get(r[4])
+        if future is not None and not future.done():
+            future.set_result(r[5])
+
+    def error_received(self, exc):
+        # Unreachable servers show up as timeouts instead
+        pass
+
+
+class MumblePoller:
+    def __init__(self, timeout=2, dns_ttl=300):
+        """
+        Pings Mumble servers over UDP from a single asyncio loop running in a background thread.
+        Every server is pinged at once, so a poll takes at most one timeout no matter how many servers it covers.
+        :param timeout: seconds to wait for a server to answer a ping
+        :param dns_ttl: seconds a resolved address is reused before the host is looked up again
+        """
+
+        self.timeout = timeout
+        self.dns_ttl = dns_ttl
+        # Dict composed of (host, port) as keys and (expiry, list of (family, sockaddr)) as values
+        self.addresses = {}
+        # Dict composed of address families as keys and the UDP transport used to ping them as values
+        self.transports = {}
+        # asyncio.Lock held while a transport is created, made on the poller's loop the first time it is needed
+        self.transport_lock = None
+        # Dict composed of ping idents as keys and the Future waiting on that ping's reply as values
+        self.waiting = {}
+        self.idents = itertools.count(1)
+
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target = self.loop.run_forever)
+        thread.daemon = True
+        thread.start()
+
+    def poll(self, servers):
+        """
+        Pings several servers concurrently, blocks the calling thread until every ping answered or timed out
+        :param servers: list of (host, port) tuples
+        :return: dict of (host, port) to their connected users, or None for servers that didn't answer
+        """
+
+        return asyncio.run_coroutine_threadsafe(self.poll_all(servers), self.loop).result()
+
+    async def poll_all(self, servers):
+        servers = list(dict.fromkeys(servers))
+        results = await asyncio.gather(*[self.poll_server(host, port) for host, port in servers])
+        return dict(zip(servers, results))
+
+    async def poll_server(self, host, port):
+        """
+        Pings every address a host resolves to and keeps the first answer
+        :return: the amount of connected users, or None if no address answered
+        """
+
+        pings = [asyncio.ensure_future(self.ping(family, sockaddr)) for family, sockaddr in
+                 await self.resolve(host, port)]
+        try:
+            for ping in asyncio.as_completed(pings):
+                users = await ping
+                if users is not None:
+                    return users
+            return None
+        finally:
+            for ping in pings:
+                ping.cancel()
+
+    async def resolve(self, host, port):
+        """
+        Resolves a host without blocking the loop, reusing the result for dns_ttl seconds
+        Failed lookups are remembered for one poll interval so an unknown host isn't looked up constantly
+        :return: a list of (family, sockaddr) tuples
+        """
+
+        cached = self.addresses.get((host, port))
+        if cached is not None and cached[0] > self.loop.time():
+            return cached[1]
+
+        try:
+            addrinfo = await self.loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM, proto=socket.IPPROTO_UDP)
+            addresses = list(dict.fromkeys((family, sockaddr) for family, socktype, proto, canonname, sockaddr
+                                           in addrinfo))
+            self.addresses[(host, port)] = (self.loop.time() + self.dns_ttl, addresses)
+        except socket.gaierror as e:
+            print(e)
+            addresses = []
+            self.addresses[(host, port)] = (self.loop.time() + 15, addresses)
+        return addresses
+
+    async def transport(self, family):
+        """
+        Creates the shared UDP transport of an address family the first time it is needed.
+        Pings started together wait on the same creation instead of each opening a socket.
+        :return: the UDP transport used to ping addresses of that family
+        """
+
+        if self.transport_lock is None:
+            self.transport_lock = asyncio.Lock()
+
+        async with self.transport_lock:
+            transport = self.transports.get(family)
+            if transport is None:
+                transport, protocol = await self.loop.create_datagram_endpoint(lambda: MumblePingProtocol(self),
+                                                                               family=family)
+                self.transports[family] = transport
+            return transport
+
+    async def ping(self, family, sockaddr):
+        """
+        :return: the amount of users connected to the server at sockaddr, or None if it didn't answer in time
+        """
+
+        transport = await self.transport(family)
+        ident = next(self.idents)
+        future = self.loop.create_future()
+        self.waiting[ident] = future
+        try:
+            transport.sendto(pack(">iQ", 0, ident), sockaddr)
+            return await asyncio.wait_for(future, self.timeout)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self.waiting.pop(ident, None)
@@ -1,3 +1,4 @@
+import copy
 import datetime
 import json
 import os
@@ -5,12 +6,16 @@ import pickle
 import random
 import socket
 import threading
+import numpy as np
+from libs.enumlookup import EnumLookup
 from libs.honorbank import HonorBank
+from libs.mediacache import MediaCache
 from enum import Enum
+from contextlib import contextmanager
 from struct import pack, unpack
 
 from plugin import Plugin
-from time import sleep
+from time import sleep, time
 
 
 # Called when the bot loads the plugin
@@ -32,11 +37,15 @@ class PocketPal(Plugin):
         self.dir = data_dir
         # A reference to the bot itself for more advanced operations
         self.bot = bot
-        # Dict composed of users as keys and a Pal obj as a value
-        self.pals = {}
+        # PalStore holding the vitals of every pal, indexed by owner
+        self.pals = PalStore()
         self.load()
+        # Table of every species' image for each mood, built once from the assets folder
+        self.pal_images = PalImages(self.dir)
         # Handles currency management for users
         self.account_manager = HonorBank()
+        # Remembers uploaded pal images so each image is only sent to Telegram once
+        self.media_cache = MediaCache(self.dir + "/media_cache.json")
 
         # Launches a deamon thread that handles alerts and random encounters
         thread = threading.Thread(target = self.update)
@@ -47,8 +56,9 @@ class PocketPal(Plugin):
     def com_check(self, command):
         user = command.user.username
 
-        if user in self.pals.keys():
-            return self.pals[user].current_status()
+        with self.pals.checkout(user) as pal:
+            if pal is not None:
+                return pal.current_status()
         return "PocketPal: You currently do not own a pal! Use '/pnew [name]' to get one!"
        
     # Feeds your pal a designated food
@@ -58,17 +68,17 @@ class PocketPal(Plugin):
         if not self.account_manager.account_exists(user):
             self.account_manager.create_account(user)
 
-        if user in self.pals.keys():
-            if Food.has_name(command.args):
-                food = Food.get_food(command.args)
-                pal = self.pals[user]
-
-                if self.account_manager.charge(user, 10):
-                    if pal.feed(food):
-                        return "PocketPal: Successfully fed your pal! This cost you 10 honor."
-                    return "PocketPal: Your pet refused to eat since it is full! This cost you 10 honor!"
-                return "PocketPal: Sorry, it costs 10 honor to feed your pet! You lack the neccessary funds..."
-            return "PocketPal: That food is currently unavailable."
+        with self.pals.checkout(user) as pal:
+            if pal is not None:
+                if Food.has_name(command.args):
+                    food = Food.get_food(command.args)
+
+                    if self.account_manager.charge(user, 10):
+                        if pal.feed(food):
+                            return "PocketPal: Successfully fed your pal! This cost you 10 honor."
+                        return "PocketPal: Your pet refused to eat since it is full! This cost you 10 honor!"
+                    return "PocketPal: Sorry, it costs 10 honor to feed your pet! You lack the neccessary funds..."
+                return "PocketPal: That food is currently unavailable."
         return "PocketPal: You currently do not own a pal! Use '/pnew [name]' to get one!"
 
     # Plays a specific game with your pal, improves happyness
@@ -78,17 +88,17 @@ class PocketPal(Plugin):
         if not self.account_manager.account_exists(user):
             self.account_manager.create_account(user)
 
-        if user in self.pals.keys():
-            if Game.has_name(command.args):
-                game = Game.get_game(command.args)
-                pal = self.pals[user]
-
-                if self.account_manager.charge(user, 20):
-                    if pal.play(game):
-                        return "PocketPal: Successfully entertained your pal! This cost you 20 honor."
-                    return "PocketPal: They don't want to play that! This cost you 20 honor."
-                return "PocketPal: Sorry, it costs 20 honor to afford that entertainment! You lack the neccessary funds..."
-            return "PocketPal: That game is currently unavailable."
+        with self.pals.checkout(user) as pal:
+            if pal is not None:
+                if Game.has_name(command.args):
+                    game = Game.get_game(command.args)
+
+                    if self.account_manager.charge(user, 20):
+                        if pal.play(game):
+                            return "PocketPal: Successfully entertained your pal! This cost you 20 honor."
+                        return "PocketPal: They don't want to play that! This cost you 20 honor."
+                    return "PocketPal: Sorry, it costs 20 honor to afford that entertainment! You lack the neccessary funds..."
+                return "PocketPal: That game is currently unavailable."
         return "PocketPal: You currently do not own a pal! Use '/pnew [name]' to get one!"
 
     # Cleans your pal
@@ -98,23 +108,28 @@ class PocketPal(Plugin):
         if not self.account_manager.account_exists(user):
             self.account_manager.create_account(user)
 
-        if user in self.pals.keys():
-            pal = self.pals[user]
-
-            if self.account_manager.charge(user, 5):
-                pal.clean_pal()
-                return "PocketPal: Successfully cleaned your pal's environment! This cost you 5 honor for supplies."
-            return "PocketPal: Sorry, it costs 5 honor to clean your pal's environment! You lack the neccessary funds..."
+        with self.pals.checkout(user) as pal:
+            if pal is not None:
+                if self.account_manager.charge(user, 5):
+                    pal.clean_pal()
+                    return "PocketPal: Successfully cleaned your pal's environment! This cost you 5 honor for supplies."
+                return "PocketPal: Sorry, it costs 5 honor to clean your pal's environment! You lack the neccessary funds..."
         return "PocketPal: You currently do not own a pal! Use '/pnew [name]' to get one!"
 
     # Views an image of your pal
     def com_view(self, command):
         user = command.user.username
 
-        if user in self.pals.keys():
-            pal = self.pals[user]
-            return pal.status_image
-        return None
+        with self.pals.checkout(user) as pal:
+            if pal is not None:
+                image = self.pal_images.get_image(pal.species, pal.image_state)
+            else:
+                image = None
+
+        if image is not None:
+            self.media_cache.send_photo(self.bot, command.chat.id, image)
+            return None
+        return {"type": "message", "message": "PocketPal: You currently do not own a pal! Use '/pnew [name]' to get one!"}
 
     # Purchase a new pal if you don't have one
     def com_new(self, command):
@@ -123,10 +138,15 @@ class PocketPal(Plugin):
         if not self.account_manager.account_exists(user):
             self.account_manager.create_account(user)
 
-        if user in self.pals.keys():
+        if user in self.pals:
             return "PocketPal: You have already own a pal!"
+        if len(self.pal_images.species) == 0:
+            return "PocketPal: Sorry! There are no pals available for adoption right now."
         if self.account_manager.charge(user, 300):
-            self.pals[user] = Pal(command.args, self.dir)
+            if self.pals.add(user, command.args, random.choice(self.pal_images.species)) is None:
+                # Another adoption for this user finished first
+                self.account_manager.pay(user, 300)
+                return "PocketPal: You have already own a pal!"
             return "PocketPal: Thank you for adopting a new pal for 300 honor! Be sure to take care of it!"
         return "PocketPal: Sorry! You require at least 300 honor to adopt a pal!"
 
@@ -137,8 +157,10 @@ class PocketPal(Plugin):
         if not self.account_manager.account_exists(user):
             self.account_manager.create_account(user)
 
-        if user in self.pals.keys():
-            pal = self.pals[user]
+        with self.pals.checkout(user) as pal:
+            if pal is None:
+                return "PocketPal: You currently do not own a pal! Use '/pnew [name]' to get one!"
+
             value = 0
 
             if pal.growth == Growth.child.value:
@@ -150,9 +172,14 @@ class PocketPal(Plugin):
             elif pal.growth == Growth.ascended.value:
                 value = 12000
 
-            del self.pals[user]
+            index = pal.index
+            name = pal.name
+            species = pal.species
+
+        # Only the sale that actually removes the pal gets paid
+        if self.pals.remove(user, index):
             self.account_manager.pay(user, value)
-            return "PocketPal: Say goodbye! Payed out {} for your {} (Species: {})".format(value, pal.name, pal.species)
+            return "PocketPal: Say goodbye! Payed out {} for your {} (Species: {})".format(value, name, species)
         return "PocketPal: You currently do not own a pal! Use '/pnew [name]' to get one!"
 
     # Shows a list of purchasable foods
@@ -173,8 +200,9 @@ class PocketPal(Plugin):
 
     # Saves all pals
     def save(self):
+        snapshot = self.pals.snapshot()
         with open(self.dir + "/pals.file", "wb") as f:
-            pickle.dump(self.pals, f)
+            pickle.dump(snapshot, f)
             f.seek(0)
             f.close()
 
@@ -183,9 +211,16 @@ class PocketPal(Plugin):
         try:
             if os.path.getsize(self.dir + "/pals.file") > 0:
                 with open(self.dir + "/pals.file", "rb") as f:
-                    self.pals = pickle.load(f)
+                    data = pickle.load(f)
                     f.seek(0)
                     f.close()
+
+                if isinstance(data, PalStore):
+                    self.pals = data
+                else:
+                    # Older files hold a dict of users to individually pickled Pal objs
+                    for user in data.keys():
+                        self.pals.add_legacy(user, data[user].legacy_state)
             print("PocketPal: Pal file successfully loaded!")
         except FileNotFoundError:
             if not os.path.exists(self.dir):
@@ -197,16 +232,22 @@ class PocketPal(Plugin):
                 f.seek(0)
                 f.close()
             print("PocketPal: No Pal file exists, creating a new one.")
-            self.pals = {}
+            self.pals = PalStore()
 
-    # Updates status of your pal
+    # Saves pals that changed every 5 minutes and catches up every idle pal once an hour
+    # Pals are otherwise only simulated when their owner uses a command on them
     def update(self):
+        sweeps = 0
         while threading.main_thread().is_alive():
-            for user in self.pals.keys():
-                self.pals[user].simulate()
-
-            self.save()
             sleep(300)
+            sweeps += 1
+
+            if sweeps % 12 == 0:
+                self.pals.sweep()
+
+            if self.pals.dirty:
+                self.pals.dirty = False
+                self.save()
 
     # Run whenever someone on telegram types one of these commands
     def on_command(self, command):
@@ -219,7 +260,7 @@ class PocketPal(Plugin):
         elif command.command == "pclean":
             return {"type": "message", "message": self.com_clean(command)}
         elif command.command == "pview":
-            return {"type": "photo", "caption": "", "file_name": self.com_view(command)}
+            return self.com_view(command)
         elif command.command == "pnew":
             return {"type": "message", "message": self.com_new(command)}
         elif command.command == "psell":
@@ -252,25 +293,92 @@ class PocketPal(Plugin):
 
 
 
+# Per-pal view over a single row of a PalStore
 class Pal():
-    def __init__(self, name, dir):
-        self.name = name
-        self.age = 0
-        self.health = 100
-        self.mood = Mood.tame.value
-        self.hunger = 100
-        self.clean = 100
-        self.growth = Growth.child.value
-        self.alive = True
-
-        self.species = random.choice(os.listdir(dir + "/assets"))
-
-        self.craving = Food.nothing
-        self.desire = Game.nothing
-        self.received_attention = False
-
-        self.status_image = dir + "/assets/{}/tame.png".format(self.species)
-        self.dir = dir
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    # Pals pickled before PalStore existed are kept as plain dicts until they are added to a store
+    def __setstate__(self, state):
+        self.store = None
+        self.index = None
+        self.legacy_state = state
+
+    @property
+    def name(self):
+        return self.store.names[self.index]
+
+    @property
+    def species(self):
+        return self.store.species[self.index]
+
+    @property
+    def age(self):
+        return int(self.store.age[self.index])
+
+    @property
+    def health(self):
+        return int(self.store.health[self.index])
+
+    @property
+    def mood(self):
+        return int(self.store.mood[self.index])
+
+    @property
+    def hunger(self):
+        return int(self.store.hunger[self.index])
+
+    @hunger.setter
+    def hunger(self, value):
+        self.store.hunger[self.index] = value
+
+    @property
+    def clean(self):
+        return int(self.store.clean[self.index])
+
+    @clean.setter
+    def clean(self, value):
+        self.store.clean[self.index] = value
+
+    @property
+    def growth(self):
+        return int(np.digitize(self.store.age[self.index], PalStore.growth_ages))
+
+    @property
+    def alive(self):
+        return bool(self.store.alive[self.index])
+
+    @property
+    def craving(self):
+        return Food(int(self.store.craving[self.index]))
+
+    @craving.setter
+    def craving(self, food):
+        self.store.craving[self.index] = food.value
+
+    @property
+    def desire(self):
+        return Game(int(self.store.desire[self.index]))
+
+    @desire.setter
+    def desire(self, game):
+        self.store.desire[self.index] = game.value
+
+    @property
+    def received_attention(self):
+        return bool(self.store.attention[self.index])
+
+    @received_attention.setter
+    def received_attention(self, value):
+        self.store.attention[self.index] = value
+
+    # Index into PalImages for this pal's current picture
+    @property
+    def image_state(self):
+        if not self.alive:
+            return PalImages.dead
+        return self.mood
 
     def feed(self, food):
         if self.hunger < 100:
@@ -297,160 +405,297 @@ class Pal():
         self.clean = 100
         return True
 
-    def simulate(self):
-        if not self.alive:
-            return
-
-        if self.health <= 0:
-            self.alive = False
-            self.status_image = self.dir + "/assets/{}/dead.png".format(self.species)
-            return
-
-        self.clean -= 4
-        self.hunger -= 2
-        self.age += 1
-        
-        if 75 <= self.hunger < 100:
-            self.health += 2
-        elif 50 <= self.hunger < 75:
-            self.health -= 1
-            self.hunger -= 1
-        elif 25 <= self.hunger < 50:
-            self.health -= 2
-            self.mood -= 1
-            self.hunger -= 2
-        elif 0 <= self.hunger < 25:
-            self.health -= 3
-            self.mood -= 1
-            self.hunger -= 2
-
-        if 95 <= self.clean < 100:
-            self.health += 2
-        elif 75 <= self.clean < 95:
-            self.health += 1
-        elif 50 <= self.clean < 75:
-            self.health -= 1
-            self.mood -= 1
-        elif 25 <= self.clean < 50:
-            self.health -= 2
-            self.mood -= 1
-            self.hunger -= 1
-        elif 0 <= self.clean < 25:
-            self.health -= 3
-            self.mood -= 1
-            self.hunger -= 1
-
-        if self.received_attention:
-            self.mood += 1
-        else:
-            self.mood -= 1
-
-        if self.mood > 9:
-            self.mood = 9
-        elif self.mood < 0:
-            self.mood = 0
-
-        if self.mood == Mood.elated.value:
-            self.health += 3
-            self.clean += 1
-            self.status_image = self.dir + "/assets/{}/elated.png".format(self.species)
-        elif self.mood == Mood.delighted.value:
-            self.health += 2
-            self.status_image = self.dir + "/assets/{}/delighted.png".format(self.species)
-        elif self.mood == Mood.happy.value:
-            self.health += 1
-            self.status_image = self.dir + "/assets/{}/happy.png".format(self.species)
-        elif self.mood == Mood.amused.value:
-            self.status_image = self.dir + "/assets/{}/amused.png".format(self.species)
-        elif self.mood == Mood.tame.value:
-            self.mood += 0
-            self.status_image = self.dir + "/assets/{}/tame.png".format(self.species)
-        elif self.mood == Mood.tired.value:
-            self.hunger -= 1
-            self.clean -= 1
-            self.status_image = self.dir + "/assets/{}/tired.png".format(self.species)
-        elif self.mood == Mood.sad.value:
-            self.health -= 1
-            self.hunger -= 2
-            self.clean -= 3
-            self.status_image = self.dir + "/assets/{}/sad.png".format(self.species)
-        elif self.mood == Mood.depressed.value:
-            self.health -= 2
-            self.hunger -= 2
-            self.clean -= 2
-            self.status_image = self.dir + "/assets/{}/depressed.png".format(self.species)
-        elif self.mood == Mood.dejected.value:
-            self.health -= 3
-            self.hunger -= 3
-            self.clean -= 3
-            self.status_image = self.dir + "/assets/{}/dejected.png".format(self.species)
-        elif self.mood == Mood.defeated.value:
-            self.health -= 5
-            self.hunger -= 4
-            self.clean -= 4
-            self.status_image = self.dir + "/assets/{}/defeated.png".format(self.species)
-
-        if self.mood > 9:
-            self.mood = 9
-        elif self.mood < 0:
-            self.mood = 0
-
-        if self.health > 100:
-            self.health = 100
-
-        if self.clean > 100:
-            self.clean = 100
-        elif self.clean < 0:
-            self.clean = 0
-
-        if self.hunger > 100:
-            self.hunger = 100
-        elif self.hunger < 0:
-            self.hunger = 0
-
-        if self.age < 288:
-            self.growth = Growth.child.value
-        elif self.age < 864:
-            self.growth = Growth.teen.value
-        elif self.age < 2016:
-            self.growth = Growth.adult.value
-        else:
-            self.growth = Growth.ascended.value
-
-        self.craving = Food.rand_food()
-        self.desire = Game.rand_game()
-        self.received_attention = False
-
     def current_status(self):
         return "{}'s status:\nSpecies: {}\nAge: {}\nHealth: {}/100\nMood: {}\nHunger: {}/100\nCleanliness: {}/100\nStage: {}\nCraving: {}\nDesire: {}".format(self.name, self.species, self.age, self.health, Mood(self.mood).name, self.hunger, self.clean, Growth(self.growth).name, self.craving.name, self.desire.name)
 
 
+# Holds the vitals of every pal in NumPy arrays so a whole simulation tick runs as a handful of array operations
+# Locking: self.lock guards ownership and the arrays themselves, each row has its own lock guarding its values.
+# The store lock is always taken before a row lock, never while holding one.
+class PalStore():
+    # Ages at which a pal becomes a teen, adult and ascended
+    growth_ages = np.array([288, 864, 2016])
+
+    # Hunger thresholds, np.digitize maps a hunger value to: <0, 0-24, 25-49, 50-74, 75-99, 100+
+    hunger_bins = np.array([0, 25, 50, 75, 100])
+    hunger_health = np.array([0, -3, -2, -1, 2, 0])
+    hunger_mood = np.array([0, -1, -1, 0, 0, 0])
+    hunger_hunger = np.array([0, -2, -2, -1, 0, 0])
+
+    # Cleanliness thresholds: <0, 0-24, 25-49, 50-74, 75-94, 95-99, 100+
+    clean_bins = np.array([0, 25, 50, 75, 95, 100])
+    clean_health = np.array([0, -3, -2, -1, 1, 2, 0])
+    clean_mood = np.array([0, -1, -1, -1, 0, 0, 0])
+    clean_hunger = np.array([0, -1, -1, 0, 0, 0, 0])
+
+    # Effects of each mood, indexed by Mood value from defeated to elated
+    mood_health = np.array([-5, -3, -2, -1, 0, 0, 0, 1, 2, 3])
+    mood_hunger = np.array([-4, -3, -2, -2, -1, 0, 0, 0, 0, 0])
+    mood_clean = np.array([-4, -3, -2, -3, -1, 0, 0, 0, 0, 1])
+
+    vitals = ["age", "health", "mood", "hunger", "clean", "craving", "desire"]
+    flags = ["alive", "attention", "in_use"]
+    # Seconds of real time that make up one simulation tick
+    tick_length = 300
+
+    def __init__(self, capacity=16):
+        self.capacity = 0
+        for field in self.vitals:
+            setattr(self, field, np.zeros(0, dtype=np.int32))
+        for field in self.flags:
+            setattr(self, field, np.zeros(0, dtype=bool))
+        self.names = []
+        self.species = []
+        # Dict composed of users as keys and the row index of their pal as values
+        self.owners = {}
+        # Time at which each pal's most recent tick was due
+        self.last_tick = np.zeros(0)
+        # Row indices of sold pals that may be reused
+        self.free = []
+        # Set whenever pals change so the update thread knows to save them
+        self.dirty = False
+        self.lock = threading.RLock()
+        self.pal_locks = []
+        self.grow(capacity)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        del state["pal_locks"]
+        return state
+
+    # Stores pickled before pals were simulated lazily start catching up from the moment they are loaded
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+        self.pal_locks = [threading.Lock() for x in range(self.capacity)]
+        if "last_tick" not in state:
+            self.last_tick = np.full(self.capacity, time())
+            self.dirty = False
+
+    # Acquires every row lock so no pal is mid-update, must be called while holding self.lock
+    def lock_all(self):
+        for pal_lock in self.pal_locks:
+            pal_lock.acquire()
+
+    def unlock_all(self):
+        for pal_lock in self.pal_locks:
+            pal_lock.release()
+
+    # Extends every array to hold at least capacity pals
+    def grow(self, capacity):
+        with self.lock:
+            # Arrays are replaced rather than resized, so no row may be written while they are copied
+            self.lock_all()
+            try:
+                extra = capacity - self.capacity
+                for field in self.vitals + self.flags + ["last_tick"]:
+                    array = getattr(self, field)
+                    setattr(self, field, np.concatenate([array, np.zeros(extra, dtype=array.dtype)]))
+                self.names += [None] * extra
+                self.species += [None] * extra
+                self.free += range(capacity - 1, self.capacity - 1, -1)
+            finally:
+                self.unlock_all()
+
+            self.pal_locks += [threading.Lock() for x in range(extra)]
+            self.capacity = capacity
+
+    # Adds a new pal for a user, returns None if the user already owns one
+    def add(self, user, name, species):
+        with self.lock:
+            if user in self.owners:
+                return None
+            if not self.free:
+                self.grow(self.capacity * 2)
+
+            index = self.free.pop()
+            with self.pal_locks[index]:
+                self.reset(index, name, species)
+            self.owners[user] = index
+            self.dirty = True
+            return Pal(self, index)
+
+    # Fills a row with a newly adopted pal's starting vitals
+    def reset(self, index, name, species):
+        self.names[index] = name
+        self.species[index] = species
+        self.age[index] = 0
+        self.health[index] = 100
+        self.mood[index] = Mood.tame.value
+        self.hunger[index] = 100
+        self.clean[index] = 100
+        self.craving[index] = Food.nothing.value
+        self.desire[index] = Game.nothing.value
+        self.alive[index] = True
+        self.attention[index] = False
+        self.in_use[index] = True
+        self.last_tick[index] = time()
+
+    # Adds a pal from the attribute dict of a Pal pickled before PalStore existed
+    def add_legacy(self, user, state):
+        pal = self.add(user, state["name"], state["species"])
+        index = pal.index
+        self.age[index] = state["age"]
+        self.health[index] = state["health"]
+        self.mood[index] = state["mood"]
+        self.hunger[index] = state["hunger"]
+        self.clean[index] = state["clean"]
+        self.craving[index] = state["craving"].value
+        self.desire[index] = state["desire"].value
+        self.alive[index] = state["alive"]
+        self.attention[index] = state["received_attention"]
+        return pal
+
+    def __contains__(self, user):
+        return user in self.owners
+
+    def __len__(self):
+        return len(self.owners)
+
+    # Yields a view of a user's pal, or None if they have none, while holding that pal's lock
+    # The pal first simulates any ticks it missed while idle
+    @contextmanager
+    def checkout(self, user):
+        with self.lock:
+            index = self.owners.get(user)
+            if index is None:
+                pal_lock = None
+            else:
+                pal_lock = self.pal_locks[index]
+
+        if pal_lock is None:
+            yield None
+            return
 
+        with pal_lock:
+            # The pal may have been sold while waiting on its lock
+            if self.owners.get(user) != index:
+                yield None
+                return
+
+            self.catch_up([index])
+            self.dirty = True
+            yield Pal(self, index)
+
+    # Removes a user's pal if it is still stored at index, returns True if it was removed
+    def remove(self, user, index):
+        with self.lock:
+            if self.owners.get(user) != index:
+                return False
+
+            with self.pal_locks[index]:
+                del self.owners[user]
+                self.in_use[index] = False
+                self.alive[index] = False
+                self.names[index] = None
+                self.species[index] = None
+            self.free.append(index)
+            self.dirty = True
+            return True
 
-class Growth(Enum):
+    # Catches up every pal that isn't currently checked out, those are caught up by their own command instead
+    def sweep(self, now=None):
+        with self.lock:
+            rows = []
+            for index in self.owners.values():
+                if self.pal_locks[index].acquire(blocking=False):
+                    rows.append(index)
+            try:
+                self.catch_up(rows, now)
+            finally:
+                for index in rows:
+                    self.pal_locks[index].release()
+
+    # Returns a consistent copy of the store for saving
+    def snapshot(self):
+        with self.lock:
+            self.lock_all()
+            try:
+                return copy.deepcopy(self)
+            finally:
+                self.unlock_all()
+
+    # Applies every tick that has come due for the given rows (all pals if rows is None)
+    def catch_up(self, rows=None, now=None):
+        if now is None:
+            now = time()
+        if rows is None:
+            rows = np.flatnonzero(self.in_use)
+        rows = np.asarray(rows, dtype=np.int64)
+
+        ticks = np.maximum((now - self.last_tick[rows]) // self.tick_length, 0).astype(np.int64)
+        self.last_tick[rows] += ticks * self.tick_length
+
+        if ticks.any():
+            self.advance(rows, ticks)
+            self.dirty = True
+
+    # Advances each row by its own number of ticks
+    # Every pass simulates all rows that still owe ticks at once, and dead pals drop out early
+    def advance(self, rows, ticks):
+        ticks = np.array(ticks, dtype=np.int64)
+        while True:
+            owing = (ticks > 0) & self.alive[rows]
+            if not owing.any():
+                return
+
+            self.simulate(rows[owing])
+            ticks[owing] -= 1
+
+    # Advances the given rows (every living pal if rows is None) by one tick
+    def simulate(self, rows=None):
+        if rows is None:
+            rows = np.flatnonzero(self.in_use)
+        rows = rows[self.alive[rows]]
+
+        # Pals that ran out of health last tick die instead of being simulated
+        dying = self.health[rows] <= 0
+        self.alive[rows[dying]] = False
+        rows = rows[~dying]
+
+        health = self.health[rows]
+        hunger = self.hunger[rows] - 2
+        clean = self.clean[rows] - 4
+        self.age[rows] += 1
+
+        hunger_band = np.digitize(hunger, self.hunger_bins)
+        clean_band = np.digitize(clean, self.clean_bins)
+
+        health += self.hunger_health[hunger_band] + self.clean_health[clean_band]
+        hunger += self.hunger_hunger[hunger_band] + self.clean_hunger[clean_band]
+        mood = self.mood[rows] + self.hunger_mood[hunger_band] + self.clean_mood[clean_band]
+        mood += np.where(self.attention[rows], 1, -1)
+        mood = np.clip(mood, 0, 9)
+
+        health += self.mood_health[mood]
+        hunger += self.mood_hunger[mood]
+        clean += self.mood_clean[mood]
+
+        self.health[rows] = np.minimum(health, 100)
+        self.hunger[rows] = np.clip(hunger, 0, 100)
+        self.clean[rows] = np.clip(clean, 0, 100)
+        self.mood[rows] = mood
+
+        self.craving[rows] = np.random.randint(0, len(Food), size=len(rows))
+        self.desire[rows] = np.random.randint(0, len(Game), size=len(rows))
+        self.attention[rows] = False
+
+
+class Growth(EnumLookup, Enum):
     child = 0
     teen = 1
     adult = 2
     ascended = 3
 
-    @classmethod
-    def has_name(Growth, name):
-        for item in Growth:
-            if name == item.name:
-                return True
-        return False
-
     @classmethod
     def get_growth(Growth, name):
-        for item in Growth:
-            if item.name == name:
-                return item
-        return None
+        return Growth.from_name(name)
 
 
 
 
-class Mood(Enum):
+class Mood(EnumLookup, Enum):
     defeated = 0
     dejected = 1
     depressed = 2
@@ -462,24 +707,14 @@ class Mood(Enum):
     delighted = 8
     elated = 9
 
-    @classmethod
-    def has_name(Mood, name):
-        for item in Mood:
-            if name == item.name:
-                return True
-        return False
-
     @classmethod
     def get_mood(Mood, name):
-        for item in Mood:
-            if item.name == name:
-                return item
-        return None
+        return Mood.from_name(name)
 
 
 
 
-class Food(Enum):
+class Food(EnumLookup, Enum):
     nothing = 0
     pizza = 1
     fried_chicken = 2
@@ -499,28 +734,18 @@ class Food(Enum):
     bacon = 16
     noodles = 17
 
-    @classmethod
-    def has_name(Food, name):
-        for item in Food:
-            if name == item.name:
-                return True
-        return False
-
     @classmethod
     def get_food(Food, name):
-        for item in Food:
-            if item.name == name:
-                return item
-        return None
+        return Food.from_name(name)
 
     @classmethod
     def rand_food(Food):
-        return random.choice(list(Food))
+        return Food.random_member()
 
 
 
 
-class Game(Enum):
+class Game(EnumLookup, Enum):
     nothing = 0
     tetris = 1
     puyo = 2
@@ -540,20 +765,38 @@ class Game(Enum):
     movies = 16
     dance = 17
 
-    @classmethod
-    def has_name(Game, name):
-        for item in Game:
-            if name == item.name:
-                return True
-        return False
-
     @classmethod
     def get_game(Game, name):
-        for item in Game:
-            if item.name == name:
-                return item
-        return None
+        return Game.from_name(name)
 
     @classmethod
     def rand_game(Game):
-        return random.choice(list(Game))
+        return Game.random_member()
+
+
+
+
+class PalImages():
+    # Image state of a dead pal, living pals use their mood value as their image state
+    dead = len(Mood)
+
+    def __init__(self, dir):
+        self.species = []
+        # Dict composed of species as keys and a tuple of image paths indexed by image state as values
+        self.images = {}
+
+        states = [mood.name for mood in Mood] + ["dead"]
+
+        try:
+            folders = sorted(os.listdir(dir + "/assets"))
+        except FileNotFoundError:
+            print("PocketPal: No assets folder found in {}, pals can't be adopted until one is added.".format(dir))
+            folders = []
+
+        for species in folders:
+            if os.path.isdir(dir + "/assets/" + species):
+                self.species.append(species)
+                self.images[species] = tuple(dir + "/assets/{}/{}.png".format(species, state) for state in states)
+
+    def get_image(self, species, state):
+        return self.images[species][state]
@@ -1,9 +1,16 @@
-import bs4 as bs
+import hashlib
+import json
+import heapq
+import os
+import urllib.parse
 import urllib.request
 import re
-import heapq
-import nltk
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, perf_counter
 
+from libs.ttlcache import TTLCache
 from plugin import Plugin
 
 
@@ -19,71 +26,507 @@ Version: v1.0.0.0
 
 
 class Summary(Plugin):
+    # Seconds a page may take to download, from connecting to reading its last byte
+    fetch_timeout = 10
+    # Largest page that will be downloaded, in bytes
+    max_bytes = 2 * 1024 * 1024
+    chunk_size = 64 * 1024
+    # Frozenset of english stopwords, see get_stopwords
+    stopwords = None
+    # Links in chat messages, used when prefetching is enabled
+    link_pattern = re.compile(r'(?:https?://|www\.)[^\s<>"]+', re.IGNORECASE)
+    prefetch_queue_size = 64
+    # Seconds between two prefetches from the same domain
+    prefetch_interval = 10
+
     def __init__(self, data_dir, bot):
         self.data_dir = data_dir
         self.bot = bot
+        self.pool = ThreadPoolExecutor(max_workers=4)
+        # Cache composed of canonical urls as keys and the content hash of the page they served as values
+        self.url_cache = TTLCache(1024, 3600)
+        # Cache composed of content hashes as keys and finished summaries as values, shared by every url serving
+        # the same page
+        self.summary_cache = TTLCache(1024, 6 * 3600)
+        # Dict composed of canonical urls as keys and the Future of their fetch as values, while it is running
+        self.pending = {}
+        self.lock = threading.RLock()
+        self.settings = self.load_settings()
+        # Summarizer backend, see get_summarizer
+        self.summarizer = None
+
+        # Links seen in chat wait here until the prefetch thread schedules them
+        self.prefetch_queue = queue.Queue()
+        # Heap of (time the link may be fetched, canonical url, link) holding links scheduled by the prefetch thread
+        self.prefetch_schedule = []
+        # Set of canonical urls that are queued or scheduled, so a link posted in several chats is queued once.
+        # Links are dropped once it holds prefetch_queue_size urls.
+        self.prefetch_queued = set()
+        # Dict composed of domains as keys and the earliest time another of their links may be fetched as values
+        self.domain_ready = {}
+
+        thread = threading.Thread(target=self.prefetch_links)
+        thread.daemon = True
+        thread.start()
+
+        # NLTK, BeautifulSoup and the summarizer backends are imported by warm_up instead of when the bot loads plugins
+        thread = threading.Thread(target=self.warm_up)
+        thread.daemon = True
+        thread.start()
+
+    @staticmethod
+    def absolute_url(url):
+        """
+        :param url: url given by a user
+        :return: the url as given, with http:// added if it has no scheme
+        """
+
+        url = url.strip()
+        if "://" not in url:
+            url = "http://" + url
+        return url
+
+    @classmethod
+    def canonical_url(cls, url):
+        """
+        Normalizes a url so that trivially different links to the same page share a cache entry.
+        Lowercases the scheme and host, drops default ports, fragments and utm_ tracking parameters
+        and sorts the query string. Only used as a key, pages are always fetched from the url as given.
+        :param url: url given by a user
+        :return: the canonical form of the url
+        """
+
+        url = cls.absolute_url(url)
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("only http and https links can be summarized")
+
+        netloc = parts.hostname.lower()
+        if parts.port is not None and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+            netloc += ":{}".format(parts.port)
+
+        query = [(key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                 if not key.startswith("utm_")]
+        return urllib.parse.urlunsplit((scheme, netloc, parts.path or "/", urllib.parse.urlencode(sorted(query)), ""))
+
+    def fetch(self, url):
+        """
+        Streams a page in chunks, giving up once it is larger than max_bytes or slower than fetch_timeout
+        :param url: url of the page as given by the user
+        :return: the raw bytes of the page
+        """
+
+        deadline = monotonic() + self.fetch_timeout
+        request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+
+        with urllib.request.urlopen(request, timeout=self.fetch_timeout) as response:
+            content_type = response.headers.get("Content-Type", "text/html")
+            if "html" not in content_type and "xml" not in content_type:
+                raise ValueError("the link is not a web page ({})".format(content_type))
+
+            length = response.headers.get("Content-Length")
+            if length is not None and length.isdigit() and int(length) > self.max_bytes:
+                raise ValueError("the page is larger than {}KB".format(self.max_bytes // 1024))
+
+            chunks = []
+            size = 0
+            while True:
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ValueError("the page is larger than {}KB".format(self.max_bytes // 1024))
+                if monotonic() > deadline:
+                    raise ValueError("the page took longer than {} seconds to load".format(self.fetch_timeout))
+                chunks.append(chunk)
+
+        return b"".join(chunks)
+
+    def summarize_url(self, url, link):
+        """
+        Fetches and summarizes a page, runs in the fetch pool.
+        Pages whose contents were already summarized under another url reuse that summary.
+        :param url: canonical url of the page, the summary is cached under it
+        :param link: url of the page as given by the user, which is the one fetched
+        :return: the summary of the page
+        """
+
+        page = self.fetch(link)
+        digest = hashlib.sha1(page).hexdigest()
+
+        summary = self.summary_cache.get(digest)
+        if summary is None:
+            summary = self.summarize_article(page)
+            self.summary_cache.put(digest, summary)
+        self.url_cache.put(url, digest)
+        return summary
+
+    def cached_summary(self, url):
+        """
+        :param url: canonical url of a page
+        :return: the cached summary of the page, or None if it hasn't been summarized recently
+        """
+
+        digest = self.url_cache.get(url)
+        if digest is not None:
+            return self.summary_cache.get(digest)
+        return None
+
+    def request_summary(self, url, link):
+        """
+        Starts summarizing a page in the fetch pool, joining the fetch already running for that url if there is one
+        :param url: canonical url of the page
+        :param link: url of the page as given by the user
+        :return: a Future holding the summary
+        """
+
+        with self.lock:
+            future = self.pending.get(url)
+            if future is None:
+                future = self.pool.submit(self.summarize_url, url, link)
+                self.pending[url] = future
+                future.add_done_callback(lambda done: self.finish_request(url))
+            return future
+
+    def finish_request(self, url):
+        with self.lock:
+            self.pending.pop(url, None)
+
+    def send_summary(self, chat_id, url, future):
+        """
+        Sends a finished summary, or the reason it failed, to the chat that asked for it
+        :param chat_id: chat that requested the summary
+        :param url: url of the page as given by the user
+        :param future: Future returned by request_summary
+        """
+
+        try:
+            message = future.result()
+        except Exception as e:
+            message = "Unable to summarize {}: {}".format(url, e)
+        self.bot.send_message(chat_id, message)
 
     def create_summary(self, command):
-        url = command.args
+        """
+        Replies straight away with a cached summary, otherwise queues the page in the fetch pool.
+        Queued summaries are sent to the chat once they are ready, so a slow site never blocks other commands.
+        :param command: input providing the url
+        :return: the summary if it was cached, otherwise None
+        """
+
+        try:
+            url = self.canonical_url(command.args)
+        except ValueError as e:
+            return "Unable to summarize {}: {}".format(command.args, e)
+
+        summary = self.cached_summary(url)
+        if summary is not None:
+            return summary
+
+        chat_id = command.chat.id
+        link = self.absolute_url(command.args)
+        self.request_summary(url, link).add_done_callback(lambda future: self.send_summary(chat_id, link, future))
+        return None
 
-        scraped_article = urllib.request.urlopen(url)
-        article = scraped_article.read()
-        parsed_article = bs.BeautifulSoup(article,'lxml')
+    @classmethod
+    def get_stopwords(cls):
+        """
+        :return: a frozenset of english stopwords, loaded from NLTK the first time it is needed
+        """
 
-        paragraphs = parsed_article.find_all('p')
-        article_text = ""
+        if cls.stopwords is None:
+            import nltk
+            cls.stopwords = frozenset(nltk.corpus.stopwords.words('english'))
+        return cls.stopwords
 
-        for p in paragraphs:
-            article_text += p.text
+    def warm_up(self):
+        """
+        Runs once in the background when the plugin loads.
+        Imports the parsing libraries and loads the punkt and stopwords models and the summarizer backend,
+        so neither bot startup nor the first /summary has to wait on them.
+        """
+
+        start = perf_counter()
+        try:
+            import bs4
+            import lxml
+            import nltk
+
+            nltk.sent_tokenize("Warm up the sentence tokenizer. It is loaded on first use.")
+            self.get_summarizer()
+            print("Summarize: Loaded NLTK models in {:.0f}ms".format((perf_counter() - start) * 1000))
+        except (ImportError, LookupError) as e:
+            print("Summarize: Unable to preload NLTK models, summaries will fail until this is fixed: {}".format(e))
+
+    def load_settings(self):
+        """
+        Loads the plugin settings from summary.json, creating the file with the defaults if one isn't found
+        :return: dict of settings
+        """
+
+        defaults = {"backend": "frequency", "digest_processes": 2, "prefetch": False}
+        try:
+            with open(self.data_dir + "/summary.json", "r") as f:
+                settings = json.load(f)
+                f.close()
+            return dict(defaults, **settings)
+        except FileNotFoundError:
+            if not os.path.exists(self.data_dir):
+                os.makedirs(self.data_dir)
+
+            with open(self.data_dir + "/summary.json", "w+") as f:
+                json.dump(defaults, f, indent=4)
+                f.close()
+            return defaults
+        except ValueError:
+            print("Summarize: Unable to parse summary.json, using the default settings.")
+            return defaults
+
+    def save_settings(self):
+        with open(self.data_dir + "/summary.json", "w+") as f:
+            json.dump(self.settings, f, indent=4)
+            f.close()
+
+    def set_prefetch(self, command):
+        """
+        Turns automatic summaries of links posted in chat on or off
+        :param command: input of on or off
+        :return: a string detailing the results of the command
+        """
+
+        if command.args.strip().lower() in ("on", "off"):
+            self.settings["prefetch"] = command.args.strip().lower() == "on"
+            self.save_settings()
+            if self.settings["prefetch"]:
+                return "Links posted in chat will now be summarized ahead of time."
+            return "Links posted in chat will no longer be summarized ahead of time."
+        return "Please enter /sprefetch [on/off]"
+
+    def queue_links(self, message):
+        """
+        Queues every link in a chat message for prefetching unless it is already cached, queued or being fetched.
+        Never blocks, links are dropped once the queue is full.
+        :param message: text of a chat message
+        """
+
+        for link in self.link_pattern.findall(message)[:5]:
+            link = self.absolute_url(link.rstrip(".,;:!?)]}'"))
+            try:
+                url = self.canonical_url(link)
+            except ValueError:
+                continue
+
+            with self.lock:
+                if url in self.prefetch_queued or url in self.pending or self.cached_summary(url) is not None:
+                    continue
+                # Links waiting on a busy domain count towards the limit as well
+                if len(self.prefetch_queued) >= self.prefetch_queue_size:
+                    print("Summarize: Prefetch queue is full, dropping {}".format(url))
+                    continue
+                self.prefetch_queue.put_nowait((url, link))
+                self.prefetch_queued.add(url)
+
+    def prefetch_links(self):
+        """
+        Runs for the lifetime of the bot.
+        Spaces queued links out so each domain is fetched at most once every prefetch_interval seconds,
+        then hands them to the fetch pool whenever they are due.
+        """
+
+        while threading.main_thread().is_alive():
+            timeout = 1.0
+            if len(self.prefetch_schedule) > 0:
+                timeout = min(timeout, max(0.0, self.prefetch_schedule[0][0] - monotonic()))
+
+            try:
+                url, link = self.prefetch_queue.get(timeout=timeout)
+                domain = urllib.parse.urlsplit(url).hostname
+                ready = max(monotonic(), self.domain_ready.get(domain, 0))
+                self.domain_ready[domain] = ready + self.prefetch_interval
+                heapq.heappush(self.prefetch_schedule, (ready, url, link))
+            except queue.Empty:
+                pass
+
+            while len(self.prefetch_schedule) > 0 and self.prefetch_schedule[0][0] <= monotonic():
+                ready, url, link = heapq.heappop(self.prefetch_schedule)
+                with self.lock:
+                    self.prefetch_queued.discard(url)
+                    if self.cached_summary(url) is None:
+                        self.request_summary(url, link)
+
+    def get_summarizer(self):
+        """
+        :return: the Summarizer backend named in the settings, created the first time it is needed
+        """
+
+        if self.summarizer is None:
+            # Built outside the lock so loading NumPy and SciPy never holds up queuing other summaries
+            from libs.summarizers import load_summarizer
+            summarizer = load_summarizer(self.settings["backend"], self.get_stopwords())
+            with self.lock:
+                if self.summarizer is None:
+                    self.summarizer = summarizer
+        return self.summarizer
+
+    @staticmethod
+    def extract_sentences(article):
+        """
+        :param article: raw html of the article
+        :return: a list of the sentences in the article's paragraphs
+        """
+
+        import bs4
+        import nltk
+
+        parsed_article = bs4.BeautifulSoup(article, 'lxml')
+        article_text = "".join(p.text for p in parsed_article.find_all('p'))
 
         # Some preprossesing
-        article_text = re.sub(r'\[[0-9]*\]', ' ', article_text)  
+        article_text = re.sub(r'\[[0-9]*\]', ' ', article_text)
         article_text = re.sub(r'\s+', ' ', article_text)
 
-        formatted_article_text = re.sub('[^a-zA-Z]', ' ', article_text )  
-        formatted_article_text = re.sub(r'\s+', ' ', formatted_article_text)  
+        return nltk.sent_tokenize(article_text)
+
+    @staticmethod
+    def format_summary(summary_sentences):
+        if len(summary_sentences) == 0:
+            raise ValueError("no article text was found on the page")
+        return "Article Summary:\n" + ' '.join(summary_sentences)
+
+    def summarize_article(self, article):
+        """
+        Summarizes an article with the configured backend
+        :param article: raw html of the article
+        :return: the summary of the article
+        """
+
+        return self.format_summary(self.get_summarizer().summarize(self.extract_sentences(article)))
+
+    def create_digest(self, command):
+        """
+        Summarizes several links at once in the background and sends them to the chat as one digest
+        :param command: input providing the urls, separated by spaces
+        :return: a string if the command was invalid, otherwise None
+        """
 
-        sentence_list = nltk.sent_tokenize(article_text) 
+        urls = []
+        for link in command.args.split():
+            try:
+                urls.append((self.canonical_url(link), self.absolute_url(link)))
+            except ValueError as e:
+                return "Unable to summarize {}: {}".format(link, e)
 
-        stopwords = nltk.corpus.stopwords.words('english')
+        if not 0 < len(urls) <= 10:
+            return "Please enter between 1 and 10 links: /digest [url] [url] ..."
 
-        word_frequencies = {}  
-        for word in nltk.word_tokenize(formatted_article_text):  
-            if word not in stopwords:
-                if word not in word_frequencies.keys():
-                    word_frequencies[word] = 1
-                else:
-                    word_frequencies[word] += 1
+        chat_id = command.chat.id
+        thread = threading.Thread(target=self.send_digest, args=(chat_id, urls))
+        thread.daemon = True
+        thread.start()
+        return None
 
-        maximum_frequncy = max(word_frequencies.values())
+    def send_digest(self, chat_id, urls):
+        """
+        Sends the digest of a set of links, or the reason it failed, to the chat that asked for it
+        :param chat_id: chat that requested the digest
+        :param urls: list of (canonical url, url as given by the user) of the pages
+        """
 
-        for word in word_frequencies.keys():  
-            word_frequencies[word] = (word_frequencies[word]/maximum_frequncy)
+        try:
+            message = self.digest(urls)
+        except Exception as e:
+            message = "Unable to summarize {}: {}".format(" ".join(link for url, link in urls), e)
+        self.bot.send_message(chat_id, message)
 
-        sentence_scores = {}  
-        for sent in sentence_list:  
-            for word in nltk.word_tokenize(sent.lower()):
-                if word in word_frequencies.keys():
-                    if len(sent.split(' ')) < 30:
-                        if sent not in sentence_scores.keys():
-                            sentence_scores[sent] = word_frequencies[word]
-                        else:
-                            sentence_scores[sent] += word_frequencies[word]
+    def digest(self, urls):
+        """
+        Fetches every link that isn't cached in the fetch pool, then summarizes all of them as one batch
+        in a process pool so they share the backend's vocabulary and statistics.
+        :param urls: list of (canonical url, url as given by the user) of the pages
+        :return: the digest message
+        """
 
-        summary_sentences = heapq.nlargest(5, sentence_scores, key=sentence_scores.get)
+        # Dict composed of canonical urls as keys and the first link given for them as values
+        links = {}
+        summaries = {}
+        fetches = {}
+        for url, link in urls:
+            links.setdefault(url, link)
+            summary = self.cached_summary(url)
+            if summary is not None:
+                summaries[url] = summary
+            elif url not in fetches:
+                fetches[url] = self.pool.submit(self.fetch, link)
 
-        summary = ' '.join(summary_sentences)
-        return "Article Summary:\n" + summary
+        pages = {}
+        for url, future in fetches.items():
+            try:
+                pages[url] = future.result()
+            except Exception as e:
+                summaries[url] = "Unable to summarize {}: {}".format(links[url], e)
+
+        # Pages that can't be parsed are reported on their own instead of failing the whole digest
+        batch = []
+        documents = []
+        for url, page in pages.items():
+            try:
+                documents.append(self.extract_sentences(page))
+                batch.append(url)
+            except Exception as e:
+                summaries[url] = "Unable to summarize {}: {}".format(links[url], e)
+
+        processes = self.settings["digest_processes"] if len(batch) > 1 else None
+        try:
+            results = self.get_summarizer().summarize_batch(documents, processes=processes)
+        except Exception as e:
+            for url in batch:
+                summaries[url] = "Unable to summarize {}: {}".format(links[url], e)
+            results = []
+
+        for url, summary_sentences in zip(batch, results):
+            try:
+                summaries[url] = self.format_summary(summary_sentences)
+            except ValueError as e:
+                summaries[url] = "Unable to summarize {}: {}".format(links[url], e)
+                continue
+
+            digest = hashlib.sha1(pages[url]).hexdigest()
+            self.summary_cache.put(digest, summaries[url])
+            self.url_cache.put(url, digest)
+
+        return "\n\n".join("{}\n{}".format(link, summaries[url]) for url, link in urls)
 
     def on_command(self, command):
         if command.command == "summary" or command.command == "s":
-            return {"type": "message", "message": self.create_summary(command)}
+            summary = self.create_summary(command)
+            if summary is not None:
+                return {"type": "message", "message": summary}
+        elif command.command == "digest":
+            response = self.create_digest(command)
+            if response is not None:
+                return {"type": "message", "message": response}
+        elif command.command == "sprefetch":
+            return {"type": "message", "message": self.set_prefetch(command)}
 
     def get_commands(self):
-        return {"summary", "s"}
+        return {"summary", "s", "digest", "sprefetch"}
 
     def get_name(self):
         return "Summarize"
 
     def get_help(self):
-        return "'/summary [url]' or '/s [url]' to view a summary of an article"
+        return "'/summary [url]' or '/s [url]' to view a summary of an article\n" \
+               "'/digest [url] [url] ...' to view summaries of up to 10 articles at once\n" \
+               "'/sprefetch [on/off]' to summarize links posted in chat ahead of time"
+
+    def on_message(self, message):
+        # Links are only queued when prefetching is enabled, summaries are never posted unasked
+        if self.settings["prefetch"]:
+            self.queue_links(message)
+        return ""
+
+    def has_message_access(self):
+        return self.settings["prefetch"]